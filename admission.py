@@ -0,0 +1,230 @@
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class OverCapacityError(Exception):
+    """Raised when a request arrives while its client, or the whole server, is at its concurrency limit"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FlightAbandoned(Exception):
+    """Raised to followers when the leader of an identical generation went away without a result"""
+
+
+class AdmissionController:
+    """
+    Non-blocking concurrency limits for generation requests.
+
+    A request takes a slot for as long as it runs; once `max_concurrent`
+    are running, or its client already holds `max_per_client`, it is
+    turned away at once with OverCapacityError instead of piling up
+    behind the others. The suggested Retry-After is the recent average
+    time a slot is held, so clients come back about when one frees up.
+
+    Background work (batch items, queued jobs) passes `wait` instead, and
+    holds a slot per model call once one frees up, so it counts against
+    the same limits without being turned away.
+    """
+
+    def __init__(self, max_concurrent=16, max_per_client=4, min_retry_after=1, max_retry_after=60):
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self.min_retry_after = min_retry_after
+        self.max_retry_after = max_retry_after
+        self._running = 0
+        self._clients = {}
+        self._avg_hold = None
+        self._cond = threading.Condition()
+        self.stats = {'admitted': 0, 'rejected_global': 0, 'rejected_client': 0, 'peak_running': 0}
+
+    def acquire(self, client, wait=None):
+        """
+        Take a slot for `client`, returning a ticket for release().
+
+        Raises OverCapacityError at once when at a limit, or, given `wait`,
+        once no slot has freed up within that many seconds.
+        """
+        deadline = None if wait is None else time.monotonic() + wait
+        with self._cond:
+            while True:
+                limit = self._limit_reached(client)
+                if limit is None:
+                    break
+                remaining = 0 if deadline is None else deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats[f'rejected_{limit}'] += 1
+                    message = ("Server is busy, please retry shortly" if limit == 'global'
+                               else "Too many concurrent requests from this client")
+                    raise OverCapacityError(message, self._retry_after())
+                self._cond.wait(remaining)
+            self._running += 1
+            self._clients[client] = self._clients.get(client, 0) + 1
+            self.stats['admitted'] += 1
+            self.stats['peak_running'] = max(self.stats['peak_running'], self._running)
+        return client, time.monotonic()
+
+    def _limit_reached(self, client):
+        """'global' or 'client' if `client` can't take a slot now, else None (caller holds the lock)"""
+        if self.max_concurrent and self._running >= self.max_concurrent:
+            return 'global'
+        if self.max_per_client and self._clients.get(client, 0) >= self.max_per_client:
+            return 'client'
+        return None
+
+    def release(self, ticket):
+        client, started = ticket
+        held_for = time.monotonic() - started
+        with self._cond:
+            self._running -= 1
+            if self._clients.get(client, 0) <= 1:
+                self._clients.pop(client, None)
+            else:
+                self._clients[client] -= 1
+            # Exponentially weighted, so the hint follows the current model latency
+            self._avg_hold = held_for if self._avg_hold is None else 0.8 * self._avg_hold + 0.2 * held_for
+            self._cond.notify_all()
+
+    def _retry_after(self):
+        """Whole seconds until a slot is likely to free up (caller holds the lock)"""
+        estimate = self._avg_hold if self._avg_hold is not None else self.min_retry_after
+        return int(min(self.max_retry_after, max(self.min_retry_after, math.ceil(estimate))))
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                **self.stats,
+                'running': self._running,
+                'clients': len(self._clients),
+                'max_concurrent': self.max_concurrent,
+                'max_per_client': self.max_per_client,
+                'avg_hold_s': round(self._avg_hold, 2) if self._avg_hold is not None else None,
+            }
+
+
+class Flight:
+    """
+    One in-progress generation that other requests can attach to.
+
+    The leader publishes content deltas as they arrive and finishes with
+    the full result or an error; followers either wait for the result or
+    replay the deltas, from the beginning, as they are published.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, delta):
+        with self._cond:
+            self.parts.append(delta)
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            if self.done:
+                return
+            self.result = result
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """The leader's result, re-raising its error"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.done, timeout):
+                raise TimeoutError("Timed out waiting for an identical generation")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def follow(self, timeout=None):
+        """Yield every delta the leader publishes, re-raising its error at the end"""
+        index = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self.done or len(self.parts) > index, timeout):
+                    raise TimeoutError("Timed out waiting for an identical generation")
+                new_parts = self.parts[index:]
+                done = self.done
+            for delta in new_parts:
+                yield delta
+            index += len(new_parts)
+            if done and index >= len(self.parts):
+                break
+        if self.error is not None:
+            raise self.error
+        # A leader that did not stream (a plain /generate_script) only publishes its result
+        if not index and self.result:
+            yield self.result
+
+
+class SingleFlight:
+    """
+    Coalesces identical generations that are running at the same time.
+
+    The first request for a key becomes the leader and makes the model
+    call; requests for the same key that arrive before it finishes attach
+    to its Flight and share the outcome, so a burst of identical prompts
+    costs one upstream call. Keys leave as soon as the leader finishes;
+    from then on the response cache answers repeats. Followers of a leader
+    that goes away (its client disconnected) get FlightAbandoned and begin
+    again, so the first of them takes over the call.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'coalesced': 0}
+
+    def begin(self, key):
+        """Return (flight, is_leader); a leader must call end() once it has finished the flight"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.stats['coalesced'] += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.stats['leaders'] += 1
+            return flight, True
+
+    def end(self, key, flight, error=None):
+        """Retire a leader's flight, sending any followers FlightAbandoned if it never finished"""
+        flight.finish(error=error or FlightAbandoned("Identical generation ended without a result"))
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def run(self, key, func):
+        """func()'s result, computed once for concurrent callers with the same key; returns (result, coalesced)"""
+        while True:
+            flight, leader = self.begin(key)
+            if leader:
+                break
+            try:
+                return flight.wait(), True
+            except FlightAbandoned:
+                logger.info("Identical generation was abandoned, taking it over")
+        try:
+            result = func()
+        except Exception as e:
+            flight.finish(error=e)
+            raise
+        else:
+            flight.finish(result)
+            return result, False
+        finally:
+            self.end(key, flight)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'in_flight': len(self._flights)}
@@ -1,141 +1,375 @@
 import os
-from tkinter import Image
-import PyPDF2
-from fpdf import FPDF
-from bs4 import BeautifulSoup
 from datetime import datetime
-from flask import Flask, request, jsonify, render_template, send_from_directory
-import pytesseract
-import requests
+from flask import Blueprint, Flask, Request, Response, current_app, g, request, jsonify, render_template, send_from_directory, stream_with_context
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 import logging
 from dotenv import load_dotenv
-from openai import OpenAI
+import base64
+import io
 import json
 import sys
+import random
 import tempfile
-from groq import Groq
-
-# app = Flask(__name__)
-app = Flask(__name__, static_folder='static')
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-
-# Add debug logging configuration
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('ocr_debug.log')
-    ]
-)
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from admission import AdmissionController, FlightAbandoned, OverCapacityError, SingleFlight
+from jobs import JobQueue, QueueFullError
+import metrics
+from metrics import stage, submit_traced
+from lazy import EXTENSION_KEY as LAZY_EXTENSION_KEY, lazy
+from llm import GroqProvider, LlmClient, StubProvider
+from response_cache import ResponseCache, make_cache_key
+from context import assemble_context, estimate_tokens, truncate_tokens
+from long_document import DocumentSummarizer
+from scheduler import RateLimitScheduler, is_rate_limited, retry_after
+
+# OCR (Pillow, pytesseract), PDF (PyPDF2, fpdf), HTML parsing and URL fetching (requests) are
+# imported where they are first used, so startup only pays for what a request needs
+
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-# Configuration
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-app.config['ALLOWED_EXTENSIONS'] = {'txt', 'pdf', 'png', 'jpg', 'jpeg'}
-
 # groqcloud API Configuration
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
-MODEL_NAME = "llama-3.3-70b-versatile"
-SCRIPTS_METADATA_FILE = 'saved_scripts/scripts_metadata.json'
+MODEL_NAME = os.getenv('MODEL_NAME', "llama-3.3-70b-versatile")
+FALLBACK_MODEL_NAME = os.getenv('FALLBACK_MODEL_NAME', "llama-3.1-8b-instant")  # faster model for slow or rate-limited calls
+TEMPERATURE = 0.7
+SCRIPTS_METADATA_FILE = 'saved_scripts/scripts_metadata.json'  # Legacy store, imported into SQLite once
+
+bp = Blueprint('main', __name__)
+
+
+def configure_logging():
+    """Configure the root logger once; LOG_LEVEL and LOG_FILE come from the environment"""
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if os.getenv('LOG_FILE'):
+        handlers.append(logging.FileHandler(os.getenv('LOG_FILE')))
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=handlers,
+    )
+
+
+def load_config(config):
+    """Read settings from the environment into a Flask config"""
+    config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    # Uploads stay in memory up to this size, then spill to an anonymous temp file
+    config['UPLOAD_SPOOL_BYTES'] = int(os.getenv('UPLOAD_SPOOL_BYTES', 2 * 1024 * 1024))
+    config['UPLOAD_SPOOL_DIR'] = os.getenv('UPLOAD_SPOOL_DIR') or None  # default: the system temp dir
+    config['ALLOWED_EXTENSIONS'] = {'txt', 'pdf', 'png', 'jpg', 'jpeg'}
+
+    # LLM provider: 'groq', or 'stub' for offline development and load tests
+    config['LLM_PROVIDER'] = os.getenv('LLM_PROVIDER', 'groq')
+    config['LLM_TIMEOUT'] = float(os.getenv('LLM_TIMEOUT', 60))  # seconds per call
+    config['LLM_MAX_RETRIES'] = int(os.getenv('LLM_MAX_RETRIES', 2))
+    config['LLM_HEDGE_AFTER'] = float(os.getenv('LLM_HEDGE_AFTER', 0))  # seconds before a hedged request, 0 disables
+    config['STUB_LATENCY'] = float(os.getenv('STUB_LATENCY', 0.5))  # seconds to first token
+    config['STUB_TOKEN_DELAY'] = float(os.getenv('STUB_TOKEN_DELAY', 0.02))  # seconds between streamed words
+
+    # Generation requests over these concurrency limits get a 429 with Retry-After instead of waiting
+    config['GENERATE_MAX_CONCURRENT'] = int(os.getenv('GENERATE_MAX_CONCURRENT', 16))  # whole server, 0 disables
+    config['GENERATE_MAX_PER_CLIENT'] = int(os.getenv('GENERATE_MAX_PER_CLIENT', 4))  # per client address, 0 disables
+    # Batch items and queued jobs take a slot per model call, waiting up to this long for one
+    config['GENERATE_SLOT_WAIT'] = float(os.getenv('GENERATE_SLOT_WAIT', 300))
+    config['PROXY_FIX_HOPS'] = int(os.getenv('PROXY_FIX_HOPS', 0))  # trusted proxies setting X-Forwarded-For
+
+    # Background generation jobs
+    config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 4))
+    config['JOB_QUEUE_SIZE'] = int(os.getenv('JOB_QUEUE_SIZE', 100))
+    config['JOB_RESULT_TTL'] = int(os.getenv('JOB_RESULT_TTL', 900))  # seconds
+
+    # Cache of generated scripts keyed on the full request content
+    config['RESPONSE_CACHE_DIR'] = os.getenv('RESPONSE_CACHE_DIR', 'cache/responses')
+    config['RESPONSE_CACHE_ENTRIES'] = int(os.getenv('RESPONSE_CACHE_ENTRIES', 256))
+    config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 7 * 24 * 3600))  # seconds
+
+    # Shared pool for concurrent file and URL ingestion
+    config['INGEST_WORKERS'] = int(os.getenv('INGEST_WORKERS', 8))
+    config['INGEST_FILE_TIMEOUT'] = float(os.getenv('INGEST_FILE_TIMEOUT', 30))  # seconds
+    config['INGEST_URL_TIMEOUT'] = float(os.getenv('INGEST_URL_TIMEOUT', 12))  # seconds
+
+    # Context assembly: sources are chunked, ranked against the prompt and packed into a token budget
+    config['CONTEXT_TOKEN_BUDGET'] = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1000))  # tokens, prompt included
+    config['CONTEXT_CHUNK_TOKENS'] = int(os.getenv('CONTEXT_CHUNK_TOKENS', 128))
+    config['CONTEXT_SOURCE_CHARS'] = int(os.getenv('CONTEXT_SOURCE_CHARS', 100000))  # text considered per source
+
+    # Long-document mode: whole sources are summarised chunk by chunk (map), then packed as context (reduce)
+    config['LONG_DOCUMENT_CHARS'] = int(os.getenv('LONG_DOCUMENT_CHARS', 400000))  # text read per source
+    config['LONG_DOCUMENT_CHUNK_TOKENS'] = int(os.getenv('LONG_DOCUMENT_CHUNK_TOKENS', 1500))
+    config['LONG_DOCUMENT_SUMMARY_TOKENS'] = int(os.getenv('LONG_DOCUMENT_SUMMARY_TOKENS', 200))
+    config['LONG_DOCUMENT_WORKERS'] = int(os.getenv('LONG_DOCUMENT_WORKERS', 4))  # concurrent summary calls
+    # Context budget in long-document mode (prompt included); summaries are reduced until they fit
+    config['LONG_DOCUMENT_TOKEN_BUDGET'] = int(os.getenv('LONG_DOCUMENT_TOKEN_BUDGET', 3000))
+    config['SUMMARY_CACHE_DIR'] = os.getenv('SUMMARY_CACHE_DIR', 'cache/summaries')
+
+    # PDF extraction stops once the context budget is filled or the time limit passes
+    config['PDF_CHAR_BUDGET'] = int(os.getenv('PDF_CHAR_BUDGET', 20000))  # characters
+    config['PDF_PAGES'] = os.getenv('PDF_PAGES', '')  # '', 'sample' or a range like '1-5'
+    config['PDF_TIME_LIMIT'] = float(os.getenv('PDF_TIME_LIMIT', 10))  # seconds
+    # Pages are parsed on this many shared threads so a slow page can be abandoned at the
+    # time limit; 0 parses inline and checks the limit between pages only
+    config['PDF_PAGE_WORKERS'] = int(os.getenv('PDF_PAGE_WORKERS', 2))
+
+    # Batch generation shares one scheduler that paces calls to the provider quota
+    config['BATCH_MAX_ITEMS'] = int(os.getenv('BATCH_MAX_ITEMS', 100))
+    config['BATCH_WORKERS'] = int(os.getenv('BATCH_WORKERS', 8))
+    config['BATCH_OUTPUT_TOKENS'] = int(os.getenv('BATCH_OUTPUT_TOKENS', 1200))  # expected script length, for pacing
+    config['BATCH_MAX_RETRIES'] = int(os.getenv('BATCH_MAX_RETRIES', 4))
+    config['GROQ_REQUESTS_PER_MINUTE'] = int(os.getenv('GROQ_REQUESTS_PER_MINUTE', 30))
+    config['GROQ_TOKENS_PER_MINUTE'] = int(os.getenv('GROQ_TOKENS_PER_MINUTE', 6000))
+
+    # OCR engine; preprocessing steps run in order (downscale, grayscale, binarize, deskew)
+    config['OCR_PREPROCESS'] = [step.strip() for step in os.getenv('OCR_PREPROCESS', 'downscale,grayscale,deskew').split(',') if step.strip()]
+    config['OCR_MAX_DIMENSION'] = int(os.getenv('OCR_MAX_DIMENSION', 2000))  # pixels
+
+    # OCR results keyed by pixel hash, with perceptual matching for near-duplicates
+    config['OCR_CACHE_PATH'] = os.getenv('OCR_CACHE_PATH', 'cache/ocr.sqlite3')
+    config['OCR_CACHE_ENTRIES'] = int(os.getenv('OCR_CACHE_ENTRIES', 5000))
+    config['OCR_CACHE_MAX_DISTANCE'] = int(os.getenv('OCR_CACHE_MAX_DISTANCE', 0))  # dHash bits for near matches, 0 (default) disables
+
+    # Shared fetcher for reference URLs (pooled connections, capped downloads, page cache)
+    config['URL_MAX_BYTES'] = int(os.getenv('URL_MAX_BYTES', 1024 * 1024))
+    config['URL_FRESH_FOR'] = int(os.getenv('URL_FRESH_FOR', 300))  # seconds before revalidating
+
+    # Saved script metadata
+    config['SCRIPTS_DB_FILE'] = os.getenv('SCRIPTS_DB_FILE', 'saved_scripts/scripts.sqlite3')
+    config['SCRIPTS_PAGE_SIZE'] = int(os.getenv('SCRIPTS_PAGE_SIZE', 24))
+
+    # PDFs render in a process pool and are stored once per distinct content
+    config['PDF_RENDER_DIR'] = os.getenv('PDF_RENDER_DIR', 'saved_scripts/rendered')
+    config['PDF_RENDER_WORKERS'] = int(os.getenv('PDF_RENDER_WORKERS', 2))
+    config['PDF_DOWNLOAD_WAIT'] = float(os.getenv('PDF_DOWNLOAD_WAIT', 30))  # seconds
+
+
+class SpooledRequest(Request):
+    """
+    Request whose file uploads are buffered in a SpooledTemporaryFile.
+
+    Each upload stays in memory up to UPLOAD_SPOOL_BYTES and only then rolls
+    over to its own temp file, which has no name on POSIX and is removed
+    when closed; Flask closes every upload when the request ends.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(
+            max_size=current_app.config['UPLOAD_SPOOL_BYTES'],
+            mode='rb+',
+            dir=current_app.config['UPLOAD_SPOOL_DIR'],
+        )
+
+
+def create_app(config=None):
+    """
+    Build the Flask app: logging, configuration and routes.
+
+    `config` overrides settings read from the environment (tests, embedding).
+    The subsystems below are built on first use for each app, from that
+    app's config, and kept in its `extensions`; a worker that never sees an
+    image upload never imports Pillow or starts Tesseract.
+    """
+    started = time.perf_counter()
+    configure_logging()
+    flask_app = Flask(__name__, static_folder='static')
+    load_config(flask_app.config)
+    if config:
+        flask_app.config.update(config)
+    flask_app.extensions[LAZY_EXTENSION_KEY] = {}
+
+    flask_app.request_class = SpooledRequest
+    if flask_app.config['PROXY_FIX_HOPS']:
+        # Per-client limits need the real client address, not the proxy's
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app, x_for=flask_app.config['PROXY_FIX_HOPS'])
+
+    # Create required directories
+    os.makedirs('saved_scripts', exist_ok=True)
+
+    flask_app.register_blueprint(bp)
+    logger.info(f"App created in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return flask_app
+
+
+def create_llm_provider(name):
+    if name == 'stub':
+        return StubProvider(latency=current_app.config['STUB_LATENCY'], token_delay=current_app.config['STUB_TOKEN_DELAY'])
+    if name == 'groq':
+        return GroqProvider(api_key=GROQ_API_KEY)
+    raise ValueError(f"Unknown LLM provider: {name}")
 
-# Initialize groqcloud client
-client = Groq(
-    api_key=GROQ_API_KEY,
-)
+@lazy
+def llm():
+    return LlmClient(
+        create_llm_provider(current_app.config['LLM_PROVIDER']),
+        MODEL_NAME,
+        fallback_model=FALLBACK_MODEL_NAME or None,
+        timeout=current_app.config['LLM_TIMEOUT'],
+        max_retries=current_app.config['LLM_MAX_RETRIES'],
+        hedge_after=current_app.config['LLM_HEDGE_AFTER'] or None,
+    )
 
-# Create required directories
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs('saved_scripts', exist_ok=True)
+@lazy
+def admission():
+    return AdmissionController(
+        max_concurrent=current_app.config['GENERATE_MAX_CONCURRENT'],
+        max_per_client=current_app.config['GENERATE_MAX_PER_CLIENT'],
+    )
+
+@lazy
+def generation_flights():
+    return SingleFlight()
+
+@lazy
+def job_queue():
+    return JobQueue(
+        workers=current_app.config['JOB_WORKERS'],
+        max_queued=current_app.config['JOB_QUEUE_SIZE'],
+        result_ttl=current_app.config['JOB_RESULT_TTL'],
+    )
+
+@lazy
+def response_cache():
+    return ResponseCache(
+        current_app.config['RESPONSE_CACHE_DIR'],
+        max_entries=current_app.config['RESPONSE_CACHE_ENTRIES'],
+        ttl=current_app.config['RESPONSE_CACHE_TTL'],
+    )
+
+@lazy
+def ingest_pool():
+    return ThreadPoolExecutor(max_workers=current_app.config['INGEST_WORKERS'], thread_name_prefix='ingest')
+
+@lazy
+def pdf_page_pool():
+    return ThreadPoolExecutor(max_workers=current_app.config['PDF_PAGE_WORKERS'], thread_name_prefix='pdf-page')
+
+def complete_chat(messages, max_tokens=None):
+    """One non-streaming Completion (text, model); 429s go to the summarizer's backoff"""
+    return llm.complete(messages, temperature=0.2, max_tokens=max_tokens, retry_rate_limits=False)
+
+@lazy
+def document_summarizer():
+    return DocumentSummarizer(
+        complete_chat,
+        ResponseCache(current_app.config['SUMMARY_CACHE_DIR'], ttl=current_app.config['RESPONSE_CACHE_TTL']),
+        MODEL_NAME,
+        workers=current_app.config['LONG_DOCUMENT_WORKERS'],
+        chunk_tokens=current_app.config['LONG_DOCUMENT_CHUNK_TOKENS'],
+        summary_tokens=current_app.config['LONG_DOCUMENT_SUMMARY_TOKENS'],
+    )
+
+@lazy
+def rate_scheduler():
+    return RateLimitScheduler(
+        requests_per_minute=current_app.config['GROQ_REQUESTS_PER_MINUTE'],
+        tokens_per_minute=current_app.config['GROQ_TOKENS_PER_MINUTE'],
+    )
+
+@lazy
+def batch_pool():
+    return ThreadPoolExecutor(max_workers=current_app.config['BATCH_WORKERS'], thread_name_prefix='batch')
+
+@lazy
+def ocr_engine():
+    from ocr import OcrEngine
+    engine = OcrEngine(
+        preprocess=current_app.config['OCR_PREPROCESS'],
+        max_dimension=current_app.config['OCR_MAX_DIMENSION'],
+    )
+    engine.probe()
+    return engine
+
+@lazy
+def ocr_cache():
+    from ocr import OcrCache
+    return OcrCache(
+        current_app.config['OCR_CACHE_PATH'],
+        signature=ocr_engine.signature,
+        max_entries=current_app.config['OCR_CACHE_ENTRIES'],
+        max_distance=current_app.config['OCR_CACHE_MAX_DISTANCE'],
+    )
+
+@lazy
+def url_fetcher():
+    from fetcher import UrlFetcher
+    return UrlFetcher(
+        max_bytes=current_app.config['URL_MAX_BYTES'],
+        fresh_for=current_app.config['URL_FRESH_FOR'],
+    )
+
+@lazy
+def pdf_renderer():
+    from pdf_render import PdfRenderPool
+    return PdfRenderPool(
+        current_app.config['PDF_RENDER_DIR'],
+        workers=current_app.config['PDF_RENDER_WORKERS'],
+    )
+
+@lazy
+def script_store():
+    from storage import ScriptStore
+    return ScriptStore(current_app.config['SCRIPTS_DB_FILE'], legacy_json_path=SCRIPTS_METADATA_FILE)
 
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
-@app.route('/static/<path:path>')
+@bp.route('/static/<path:path>')
 def send_static(path):
     return send_from_directory('static', path)
 
-@app.route('/static/examples/<path:filename>')
+@bp.route('/static/examples/<path:filename>')
 def serve_example(filename):
     """Serve example files from the static/examples directory"""
     return send_from_directory('static/examples', filename)
 
-def check_ocr_installation():
-    """Check if Tesseract OCR is properly installed and configured"""
-    try:
-        version = pytesseract.get_tesseract_version()
-        logger.info(f"Tesseract OCR version: {version}")
-        return True
-    except Exception as e:
-        logger.error(f"Tesseract OCR not properly installed: {str(e)}")
-        return False
-
-def validate_image(image_path):
-    """Validate image file and check if it's suitable for OCR"""
-    try:
-        with Image.open(image_path) as img:
-            # Check image size
-            width, height = img.size
-            if width < 50 or height < 50:
-                logger.warning(f"Image too small: {width}x{height}")
-                return False, "Image too small for OCR"
-            
-            # Check image mode
-            if img.mode not in ['L', 'RGB']:
-                logger.warning(f"Unsupported image mode: {img.mode}")
-                return False, "Unsupported image format"
-            
-            # Check file size
-            file_size = os.path.getsize(image_path) / (1024 * 1024)  # Size in MB
-            if file_size > 10:
-                logger.warning(f"Image file too large: {file_size:.2f}MB")
-                return False, "File size too large"
-            
-            return True, "Image valid for OCR"
-    except Exception as e:
-        logger.error(f"Image validation error: {str(e)}")
-        return False, str(e)
+def source_size(source):
+    """Size in bytes of a path or a seekable binary file object"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    size = source.seek(0, io.SEEK_END)
+    source.seek(position)
+    return size
 
-def extract_text_from_image(image_path):
-    """Extract text from image using OCR with enhanced debugging"""
+def extract_text_from_image(image):
+    """Extract text from an image (a path or binary file object) using OCR with enhanced debugging"""
     try:
-        # Check OCR installation first
-        if not check_ocr_installation():
+        # Tesseract is probed once per process
+        if not ocr_engine.available:
             return "OCR not available"
 
-        # Validate image
-        is_valid, message = validate_image(image_path)
-        if not is_valid:
-            logger.error(f"Image validation failed: {message}")
-            return f"Image validation failed: {message}"
+        # Check file size
+        file_size = source_size(image) / (1024 * 1024)  # Size in MB
+        if file_size > 10:
+            logger.warning(f"Image file too large: {file_size:.2f}MB")
+            return "Image validation failed: File size too large"
 
         # Log OCR attempt
-        logger.info(f"Starting OCR processing for: {image_path}")
-        
-        # Open and preprocess image
-        with Image.open(image_path) as img:
-            # Convert to RGB if needed
-            if img.mode not in ['L', 'RGB']:
-                img = img.convert('RGB')
-            
-            # Create temporary file for processed image
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-                img.save(tmp_file.name, 'PNG')
-                logger.debug(f"Saved preprocessed image to: {tmp_file.name}")
-                
-                # Perform OCR
-                text = pytesseract.image_to_string(tmp_file.name)
-                
-                # Clean up temporary file
-                os.unlink(tmp_file.name)
+        logger.info(f"Starting OCR processing for: {getattr(image, 'name', image)}")
+
+        # Decode once and keep the image in memory for validation, preprocessing and OCR
+        from PIL import Image
+        with Image.open(image) as img:
+            is_valid, message = ocr_engine.validate(img)
+            if not is_valid:
+                logger.error(f"Image validation failed: {message}")
+                return f"Image validation failed: {message}"
+
+            # Repeat uploads (including re-encoded or resized copies) skip Tesseract
+            with stage('ocr_cache'):
+                cache_keys = ocr_cache.keys_for(img)
+                text = ocr_cache.get(cache_keys)
+            if text is None:
+                with stage('ocr'):
+                    text = ocr_engine.recognize(img)
+                ocr_cache.set(cache_keys, text)
+            else:
+                logger.info("Serving OCR result from cache")
 
         # Validate OCR result
         if not text.strip():
@@ -149,122 +383,540 @@ def extract_text_from_image(image_path):
         logger.error(f"OCR processing error: {str(e)}", exc_info=True)
         return f"OCR Error: {str(e)}"
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file"""
+def select_pdf_pages(page_count, pages=None, sample_size=3):
+    """
+    Choose which page indices to read.
+
+    `pages` is None for every page in order, 'sample' for `sample_size` pages
+    each from the start, middle and end, or a 1-based range spec like '1-3,7'.
+    """
+    if not pages:
+        return range(page_count)
+
+    if pages == 'sample':
+        middle = max(0, page_count // 2 - sample_size // 2)
+        candidates = (list(range(sample_size))
+                      + list(range(middle, middle + sample_size))
+                      + list(range(page_count - sample_size, page_count)))
+        return sorted({i for i in candidates if 0 <= i < page_count})
+
+    selected = []
+    for part in pages.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            start, end = int(start or 1), int(end or page_count)
+        else:
+            start = end = int(part)
+        selected.extend(i for i in range(start - 1, min(end, page_count)) if i >= 0)
+    return list(dict.fromkeys(selected))
+
+def extract_page_text(pdf_reader, index, timeout, executor):
+    """
+    Text of one page, or None if it is still being extracted after `timeout` seconds.
+
+    The page is parsed on `executor`, so one pathological page can't hold the
+    caller past its deadline. An abandoned parse keeps its worker until it
+    finishes (or fails on the closed file), which bounds the CPU that slow
+    pages can tie up to the executor's size; once every worker is busy, new
+    pages simply time out in the queue.
+    """
+    future = executor.submit(lambda: pdf_reader.pages[index].extract_text() or "")
+    try:
+        return future.result(timeout)
+    except FuturesTimeoutError:
+        future.cancel()
+        return None
+
+def iter_pdf_text(pdf_reader, page_indices, time_limit=None, executor=None):
+    """
+    Yield the text of each selected page lazily, stopping at the time limit.
+
+    The limit is checked before every page; with an `executor` it also cuts
+    off a page that is still being parsed when the limit passes.
+    """
+    started = time.monotonic()
+    for index in page_indices:
+        if time_limit is None:
+            yield pdf_reader.pages[index].extract_text() or ""
+            continue
+        remaining = time_limit - (time.monotonic() - started)
+        if remaining <= 0:
+            text = None
+        elif executor is None:
+            text = pdf_reader.pages[index].extract_text() or ""
+        else:
+            text = extract_page_text(pdf_reader, index, remaining, executor)
+        if text is None:
+            logger.warning(f"PDF extraction hit the {time_limit}s time limit at page {index + 1}")
+            return
+        yield text
+
+@contextmanager
+def open_binary(source):
+    """Open a path for reading, or pass through an already open file object without closing it"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            yield file
+    else:
+        source.seek(0)
+        yield source
+
+def extract_text_from_pdf(pdf, max_chars=None, max_tokens=None, pages=None, time_limit=None, executor=None):
+    """
+    Extract text from a PDF, given as a path or a seekable binary file object
+
+    Pages are parsed one at a time and extraction stops as soon as the
+    character or token budget is filled, so large documents only cost the
+    pages that are actually used.
+    """
     try:
-        text = ""
-        with open(pdf_path, 'rb') as file:
+        parts = []
+        total_chars = 0
+        total_tokens = 0
+        import PyPDF2
+        with open_binary(pdf) as file:
             pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text.strip()
+            try:
+                page_indices = select_pdf_pages(len(pdf_reader.pages), pages)
+            except ValueError:
+                logger.warning(f"Invalid PDF page selection '{pages}', reading from the start")
+                page_indices = select_pdf_pages(len(pdf_reader.pages))
+            for page_text in iter_pdf_text(pdf_reader, page_indices, time_limit, executor):
+                parts.append(page_text)
+                total_chars += len(page_text) + 1
+                if max_chars is not None and total_chars >= max_chars:
+                    break
+                if max_tokens is not None:
+                    total_tokens += estimate_tokens(page_text)
+                    if total_tokens >= max_tokens:
+                        break
+        text = "\n".join(parts).strip()
+        if max_chars is not None:
+            text = text[:max_chars]
+        if max_tokens is not None:
+            text = truncate_tokens(text, max_tokens)
+        logger.info(f"Extracted {len(text)} characters from {len(parts)} PDF pages")
+        return text
     except Exception as e:
         logging.error(f"Error in PDF processing: {str(e)}")
         return ""
 
-def process_file_content(file):
-    """Process uploaded files with enhanced error handling and logging"""
+def image_data_url(stream, file_type):
+    """Inline an uploaded image as a data URL, so it can reach the model without touching disk"""
+    stream.seek(0)
+    mimetype = 'image/png' if file_type == 'png' else 'image/jpeg'
+    return f"data:{mimetype};base64,{base64.b64encode(stream.read()).decode('ascii')}"
+
+def process_file_content(file, pdf_pages=None, pdf_char_budget=None):
+    """
+    Process an uploaded file straight from its request stream.
+
+    Returns the extracted text, or a data URL for an image whose OCR
+    produced nothing usable. Nothing is written under uploads/: the stream
+    is in memory, or an anonymous temp file for uploads above
+    UPLOAD_SPOOL_BYTES, and is closed with the request.
+    """
     if not file or not allowed_file(file.filename):
         logger.warning(f"Invalid file or filename: {getattr(file, 'filename', 'No file')}")
         return ""
 
     try:
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        logger.info(f"File saved successfully: {filepath}")
-        
         file_type = filename.rsplit('.', 1)[1].lower()
+        stream = file.stream
+        stream.seek(0)
         
         # Process different file types
         if file_type in ['jpg', 'jpeg', 'png']:
             logger.info(f"Processing image file: {filename}")
-            ocr_result = extract_text_from_image(filepath)
+            ocr_result = extract_text_from_image(stream)
             
             if ocr_result.startswith(("OCR Error:", "Image validation failed:", "No text detected")):
                 logger.warning(f"OCR processing issue: {ocr_result}")
-                return filepath  # Return path for image processing
+                return image_data_url(stream, file_type)  # Send the image itself instead
             
             logger.info("OCR processing successful")
             return f"OCR Extract:\n{ocr_result}"
             
         elif file_type == 'pdf':
-            file_content = extract_text_from_pdf(filepath)
+            with stage('pdf_extract'):
+                file_content = extract_text_from_pdf(
+                    stream,
+                    max_chars=pdf_char_budget or current_app.config['PDF_CHAR_BUDGET'],
+                    pages=pdf_pages or current_app.config['PDF_PAGES'] or None,
+                    time_limit=current_app.config['PDF_TIME_LIMIT'],
+                    executor=pdf_page_pool if current_app.config['PDF_PAGE_WORKERS'] else None
+                )
             return f"PDF Extract:\n{file_content}"
         
         else:  # For text files
-            with open(filepath, 'r', encoding='utf-8') as f:
-                file_content = f.read()
-        
-        # Clean up the uploaded file
-        os.remove(filepath)
-        return file_content
+            with stage('text_read'):
+                return stream.read().decode('utf-8')
             
     except Exception as e:
         logger.error(f"Error processing file: {str(e)}")
-        if os.path.exists(filepath):
-            os.remove(filepath)
         return ""
 
-def generate_script_with_xai(prompt, image_path=None, additional_context=""):
-    try:
-        messages = []
-        
-        # Add system message
+SYSTEM_PROMPT = "You are a professional video script writer. Create engaging and well-structured video scripts."
+
+def build_messages(prompt, image_url=None, additional_context=""):
+    """Build the chat messages sent to the model"""
+    messages = []
+
+    # Add system message
+    messages.append({
+        "role": "system",
+        "content": SYSTEM_PROMPT
+    })
+
+    # If there's an image, add it to the messages
+    if (image_url):
+        messages.append({
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url,
+                        "detail": "high",
+                    },
+                },
+                {
+                    "type": "text",
+                    "text": f"{prompt}\n\nAdditional Context:\n{additional_context}".strip(),
+                },
+            ],
+        })
+    else:
+        # Text-only prompt
         messages.append({
-            "role": "system",
-            "content": "You are a professional video script writer. Create engaging and well-structured video scripts."
+            "role": "user",
+            "content": f"{prompt}\n\nAdditional Context:\n{additional_context}".strip()
         })
 
-        # If there's an image, add it to the messages
-        if (image_path):
-            messages.append({
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_path,
-                            "detail": "high",
-                        },
-                    },
-                    {
-                        "type": "text",
-                        "text": f"{prompt}\n\nAdditional Context:\n{additional_context}".strip(),
-                    },
-                ],
-            })
-        else:
-            # Text-only prompt
-            messages.append({
-                "role": "user",
-                "content": f"{prompt}\n\nAdditional Context:\n{additional_context}".strip()
-            })
+    return messages
 
-        # Make the API call
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=messages,
-            temperature=0.7,
-        )
+def response_cache_key(prompt, image_url=None, additional_context=""):
+    """Cache key for a generation, or None when the request can't be cached"""
+    # Requests carrying an inline image are left uncached
+    if image_url:
+        return None
+    return make_cache_key(MODEL_NAME, TEMPERATURE, SYSTEM_PROMPT, prompt, additional_context)
+
+def request_script(prompt, image_url=None, additional_context="", retry_rate_limits=True):
+    """
+    Call the model for one script and cache it; API errors propagate to the caller.
+
+    Callers paced by the rate scheduler turn off `retry_rate_limits` so they see every 429.
+    """
+    messages = build_messages(prompt, image_url, additional_context)
+
+    # Make the API call
+    started = time.perf_counter()
+    with stage('llm'):
+        script, answered_by = llm.complete(messages, temperature=TEMPERATURE, retry_rate_limits=retry_rate_limits)
+    if script:
+        metrics.LLM_TOKENS_PER_SECOND.observe(estimate_tokens(script) / (time.perf_counter() - started), 'complete')
 
+    # A bypassed request still stores its result, replacing the older variation. The key names
+    # MODEL_NAME, so a fallback model's answer is served once but never cached under it
+    cache_key = response_cache_key(prompt, image_url, additional_context)
+    if cache_key and script and answered_by == llm.model:
+        response_cache.set(cache_key, script)
+    return script
+
+def generate_script_with_xai(prompt, image_url=None, additional_context="", bypass_cache=False):
+    try:
+        cache_key = response_cache_key(prompt, image_url, additional_context)
+        if cache_key and not bypass_cache:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Serving script from response cache")
+                return {
+                    "success": True,
+                    "script": cached,
+                    "cached": True
+                }
+
+        if not cache_key or bypass_cache:
+            return {
+                "success": True,
+                "script": request_script(prompt, image_url, additional_context)
+            }
+
+        # Identical requests already running share that call instead of making their own
+        script, coalesced = generation_flights.run(
+            cache_key, lambda: request_script(prompt, image_url, additional_context))
+        if coalesced:
+            logger.info("Joined an identical generation already in progress")
+            return {"success": True, "script": script, "coalesced": True}
+        return {"success": True, "script": script}
+
+    except Exception as e:
+        logging.error(f"Error calling X.ai API: {str(e)}")
         return {
+            "success": False,
+            "error": str(e)
+        }
+
+def stream_script_with_xai(prompt, image_url=None, additional_context="", bypass_cache=False):
+    """
+    Stream a script from the model, yielding (event, payload) tuples.
+
+    Emits a 'token' event per content delta, a 'first_token' event carrying the
+    time-to-first-token, and a final 'done' event with the assembled script.
+    Cached scripts are replayed as a single token; a request identical to one
+    already running follows that generation's deltas instead of calling the model.
+    If that generation is abandoned, the follower takes over, first sending a
+    'restart' event when it has already passed on deltas the client should drop.
+    """
+    started = time.perf_counter()
+    ttft_ms = None
+    first_token_at = None
+    parts = []
+    flight = None
+    leader = True
+    try:
+        cache_key = response_cache_key(prompt, image_url, additional_context)
+        cached = response_cache.get(cache_key) if cache_key and not bypass_cache else None
+        if cached is not None:
+            ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield "first_token", {"ttft_ms": ttft_ms}
+            yield "token", {"delta": cached}
+            yield "done", {
+                "success": True,
+                "script": cached,
+                "cached": True,
+                "ttft_ms": ttft_ms,
+                "total_ms": ttft_ms
+            }
+            return
+
+        while True:
+            if cache_key and not bypass_cache:
+                flight, leader = generation_flights.begin(cache_key)
+            if leader:
+                deltas = llm.stream(build_messages(prompt, image_url, additional_context), temperature=TEMPERATURE)
+            else:
+                logger.info("Following an identical generation already in progress")
+                deltas = flight.follow()
+
+            try:
+                for delta in deltas:
+                    if ttft_ms is None:
+                        ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+                        first_token_at = time.perf_counter()
+                        if leader:
+                            metrics.LLM_TIME_TO_FIRST_TOKEN.observe(ttft_ms / 1000)
+                        logger.info(f"Time to first token: {ttft_ms}ms")
+                        yield "first_token", {"ttft_ms": ttft_ms}
+                    parts.append(delta)
+                    if flight and leader:
+                        flight.publish(delta)
+                    yield "token", {"delta": delta}
+            except FlightAbandoned:
+                # The leader's client went away; begin again, leading the call if nobody else has
+                logger.info("Identical generation was abandoned, taking it over")
+                if parts:
+                    parts.clear()
+                    yield "restart", {}
+                continue
+            break
+
+        script = "".join(parts)
+        if leader and cache_key and script and deltas.model == llm.model:
+            response_cache.set(cache_key, script)
+        if flight and leader:
+            flight.finish(script)
+
+        # The body streams after the response headers, so this only reaches /metrics
+        metrics.record_stage('llm_stream' if leader else 'coalesced_wait', time.perf_counter() - started)
+        if leader and script and first_token_at and time.perf_counter() > first_token_at:
+            metrics.LLM_TOKENS_PER_SECOND.observe(
+                estimate_tokens(script) / (time.perf_counter() - first_token_at), 'stream')
+
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Streamed script complete in {total_ms}ms")
+        done = {
             "success": True,
-            "script": completion.choices[0].message.content
+            "script": script,
+            "ttft_ms": ttft_ms,
+            "total_ms": total_ms
         }
+        if not leader:
+            done["coalesced"] = True
+        yield "done", done
 
     except Exception as e:
-        logging.error(f"Error calling X.ai API: {str(e)}")
-        return {
+        logging.error(f"Error streaming from X.ai API: {str(e)}")
+        if flight and leader:
+            flight.finish(error=e)
+        yield "error", {
             "success": False,
             "error": str(e)
         }
 
-@app.route('/')
+    finally:
+        # Also reached when the client disconnects mid-stream, so followers are never left waiting
+        if flight and leader:
+            generation_flights.end(cache_key, flight)
+
+def format_sse(event, payload):
+    """Format a single Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/generate_script', methods=['POST'])
+def source_char_limit(long_document=False):
+    """How much text to take from one source; long-document mode reads far more"""
+    return current_app.config['LONG_DOCUMENT_CHARS'] if long_document else current_app.config['CONTEXT_SOURCE_CHARS']
+
+def load_file_source(file, pdf_pages=None, long_document=False):
+    """Extract context from one uploaded file, returning (file_content, image_url)"""
+    result = process_file_content(file, pdf_pages,
+                                  pdf_char_budget=current_app.config['LONG_DOCUMENT_CHARS'] if long_document else None)
+    if isinstance(result, str):
+        return result[:source_char_limit(long_document)], None
+    return "", result
+
+def load_url_source(url, long_document=False):
+    """Fetch one reference URL, returning (header, text) for context assembly"""
+    import requests
+    try:
+        with stage('url_fetch'):
+            content = url_fetcher.fetch_text(url, max_chars=source_char_limit(long_document))
+        return f"Reference URL ({url}):", content
+
+    except requests.RequestException as e:
+        logging.warning(f"Error fetching URL content: {str(e)}")
+        return f"Reference URL: {url}", ""
+
+def run_ingestion(tasks):
+    """
+    Run ingestion tasks concurrently on the shared pool.
+
+    `tasks` is a list of (name, timeout, func, args). Returns {name: result};
+    a source that fails or misses its own deadline is logged and left out, so
+    the request waits roughly as long as its slowest successful source.
+    """
+    started = time.monotonic()
+    futures = [(name, started + timeout, submit_traced(ingest_pool, func, *args)) for name, timeout, func, args in tasks]
+
+    results = {}
+    for name, deadline, future in sorted(futures, key=lambda f: f[1]):
+        try:
+            results[name] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            future.cancel()
+            logger.warning(f"Dropping source {name}: timed out")
+        except Exception as e:
+            logger.error(f"Dropping source {name}: {str(e)}")
+
+    logger.info(f"Ingested {len(results)}/{len(tasks)} sources in {time.monotonic() - started:.2f}s")
+    return results
+
+def collect_generation_inputs(prompt, files=(), urls=(), pdf_pages=None, long_document=False, texts=()):
+    """
+    Gather file, URL and plain-text context for a generation.
+
+    Sources are split into chunks, ranked against the prompt with BM25 and
+    packed into what is left of CONTEXT_TOKEN_BUDGET after the prompt. In
+    long-document mode, sources too long for one chunk are first summarised
+    chunk by chunk, the summaries are reduced to their share of the larger
+    LONG_DOCUMENT_TOKEN_BUDGET, and those are packed instead.
+
+    Returns (image_url, additional_context, timings).
+    """
+    timings = {}
+    started = time.perf_counter()
+    tasks = []
+    for i, file in enumerate(f for f in files if f and f.filename):
+        tasks.append((f'file:{i}', current_app.config['INGEST_FILE_TIMEOUT'], load_file_source,
+                      (file, pdf_pages, long_document)))
+    for i, url in enumerate(u.strip() for u in urls if u and u.strip()):
+        tasks.append((f'url:{i}', current_app.config['INGEST_URL_TIMEOUT'], load_url_source, (url, long_document)))
+
+    results = run_ingestion(tasks) if tasks else {}
+    timings['ingest_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    # Keep the original source order so the context layout is stable
+    image_url = None
+    file_sources = []
+    url_sources = []
+    for name, _, _, args in tasks:
+        if name not in results:
+            if name.startswith('url:'):
+                url_sources.append((f"Reference URL: {args[0]}", ""))
+            continue
+        if name.startswith('file:'):
+            file_content, file_image = results[name]
+            # Only the first image that needs the model's eyes is sent
+            if file_image and not image_url:
+                image_url = file_image
+            if file_content:
+                file_sources.append(("File Content:", file_content))
+        else:
+            url_sources.append(results[name])
+
+    sources = [("Context:", text) for text in texts if text] + file_sources + url_sources
+
+    # The prompt always goes in whole; context gets whatever budget remains
+    budget = current_app.config['LONG_DOCUMENT_TOKEN_BUDGET' if long_document else 'CONTEXT_TOKEN_BUDGET']
+    token_budget = max(0, budget - estimate_tokens(prompt))
+    if long_document:
+        sources, timings['summarize'] = summarize_sources(sources, token_budget)
+
+    started = time.perf_counter()
+    with stage('context_pack'):
+        additional_context, _ = assemble_context(
+            prompt, sources, token_budget,
+            chunk_tokens=current_app.config['CONTEXT_CHUNK_TOKENS'])
+    timings['context_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    return image_url, additional_context, timings
+
+def summarize_sources(sources, token_budget):
+    """
+    Replace long sources with their summaries, returning (sources, timings per source).
+
+    Short sources are kept whole and each long one is reduced to an equal
+    share of what they leave of `token_budget`, so every summary reaches generation.
+    """
+    long_sources = [text for _, text in sources if document_summarizer.needs_summary(text)]
+    short_tokens = sum(estimate_tokens(text) for _, text in sources if text not in long_sources)
+    share = max(1, (token_budget - short_tokens) // max(1, len(long_sources)))
+    summarized = []
+    timings = []
+    for header, text in sources:
+        if not document_summarizer.needs_summary(text):
+            summarized.append((header, text))
+            continue
+        with stage('summarize'):
+            summary, source_timings = document_summarizer.summarize(text, max_tokens=share)
+        timings.append(source_timings)
+        # Fall back to the raw text if every chunk failed, so context packing still has something
+        summarized.append((f"{header} (summarized)", summary) if summary else (header, text))
+    return summarized, timings
+
+def wants_fresh_script():
+    """Check whether the client asked to bypass the response cache"""
+    return request.form.get('fresh', '').lower() in ('1', 'true', 'yes', 'on')
+
+def wants_long_document():
+    """Check whether the client asked for map-reduce summaries of long sources"""
+    return request.form.get('long_document', '').lower() in ('1', 'true', 'yes', 'on')
+
+def wants_event_stream():
+    """Check whether the client prefers an SSE response over JSON"""
+    best = request.accept_mimetypes.best_match(['application/json', 'text/event-stream'])
+    return best == 'text/event-stream'
+
+@bp.route('/generate_script', methods=['POST'])
 def generate_script():
     try:
         # Get prompt from form
@@ -272,75 +924,19 @@ def generate_script():
         if not prompt:
             return jsonify({"success": False, "error": "No prompt provided"}), 400
 
-        # Process uploaded file if any
-        image_path = None
-        file_content = ""
-        if 'file' in request.files and request.files['file'].filename:
-            result = process_file_content(request.files['file'])
-            if isinstance(result, str):
-                if result.startswith(('OCR Extract:', 'PDF Extract:')):
-                    file_content = result
-                else:
-                    file_content = result[:4000]  # Limit file content
-            else:
-                image_path = result
+        if wants_event_stream():
+            return generate_script_stream()
 
-        # Process URL if provided
-        url_content = ""
-        url = request.form.get('url', '').strip()
-        if url:
-            try:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-                url_response = requests.get(url, headers=headers, timeout=10)
-                url_response.raise_for_status()
-
-                # Extract main content and limit its size
-                content = url_response.text
-
-                # Then replace the content cleaning part with:
-                soup = BeautifulSoup(content, 'html.parser')
-                # Remove scripts, styles, and other unnecessary elements
-                for element in soup(['script', 'style', 'meta', 'link']):
-                    element.decompose()
-                content = soup.get_text(separator=' ', strip=True)
-                
-                # Limit content length
-                max_content_length = 4000  # Adjust this value as needed
-                if len(content) > max_content_length:
-                    content = content[:max_content_length] + "..."
-                
-                url_content = f"Reference URL ({url}):\n{content}"
-
-            except requests.RequestException as e:
-                logging.warning(f"Error fetching URL content: {str(e)}")
-                url_content = f"Reference URL: {url}"
-
-        # Combine additional context with length limits
-        additional_context = ""
-        if file_content:
-            additional_context += f"File Content:\n{file_content[:2000]}\n\n"  # Limit file content
-        if url_content:
-            additional_context += f"{url_content[:2000]}\n\n"  # Limit URL content
-
-        # Ensure total prompt length is within limits
-        max_prompt_length = 4000  # Adjust based on model's requirements
-        combined_prompt = f"{prompt}\n\nAdditional Context:\n{additional_context}".strip()
-        if len(combined_prompt) > max_prompt_length:
-            # Prioritize the main prompt and trim additional context
-            available_length = max_prompt_length - len(prompt) - 100  # Leave some buffer
-            if available_length > 0:
-                additional_context = additional_context[:available_length] + "..."
-            else:
-                additional_context = ""
+        image_url, additional_context, timings = collect_generation_inputs(
+            prompt, request.files.getlist('file'), request.form.getlist('url'),
+            request.form.get('pdf_pages', '').strip() or None, long_document=wants_long_document())
 
         # Generate script using X.ai API
-        result = generate_script_with_xai(prompt, image_path, additional_context)
-        
-        # Clean up image file if it exists
-        if image_path and os.path.exists(image_path):
-            os.remove(image_path)
+        started = time.perf_counter()
+        result = generate_script_with_xai(prompt, image_url, additional_context,
+                                          bypass_cache=wants_fresh_script())
+        timings['generate_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        result['timings'] = timings
         
         if result["success"]:
             return jsonify(result)
@@ -354,6 +950,335 @@ def generate_script():
             "error": str(e)
         }), 500
 
+@bp.route('/generate_script/stream', methods=['POST'])
+def generate_script_stream():
+    """Generate a script and relay the model output as Server-Sent Events"""
+    try:
+        prompt = request.form.get('prompt', '').strip()
+        if not prompt:
+            return jsonify({"success": False, "error": "No prompt provided"}), 400
+
+        # Inputs are collected before streaming starts, while the upload is still available
+        image_url, additional_context, timings = collect_generation_inputs(
+            prompt, request.files.getlist('file'), request.form.getlist('url'),
+            request.form.get('pdf_pages', '').strip() or None, long_document=wants_long_document())
+        bypass_cache = wants_fresh_script()
+
+        def event_stream():
+            yield format_sse("start", {"model": MODEL_NAME, "timings": timings})
+            for event, payload in stream_script_with_xai(prompt, image_url, additional_context,
+                                                         bypass_cache=bypass_cache):
+                yield format_sse(event, payload)
+
+        return Response(
+            stream_with_context(event_stream()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
+    except Exception as e:
+        logging.error(f"Error in generate_script_stream: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+def run_generation_job(job, flask_app, client, prompt, uploads, urls, pdf_pages=None, bypass_cache=False,
+                       long_document=False):
+    """Run the full generation pipeline for a queued job, in the app that queued it"""
+    with flask_app.app_context():
+        files = [FileStorage(stream=io.BytesIO(data), filename=filename) for filename, data in uploads]
+
+        image_url, additional_context, timings = collect_generation_inputs(
+            prompt, files, urls, pdf_pages, long_document=long_document)
+        if job.cancelled:
+            return None
+
+        started = time.perf_counter()
+        with generation_slot(client):
+            result = generate_script_with_xai(prompt, image_url, additional_context, bypass_cache=bypass_cache)
+        if not result["success"]:
+            raise RuntimeError(result["error"])
+        timings['generate_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        result['timings'] = timings
+        return result
+
+@bp.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a script generation and return its job ID immediately"""
+    try:
+        prompt = request.form.get('prompt', '').strip()
+        if not prompt:
+            return jsonify({"success": False, "error": "No prompt provided"}), 400
+
+        # Uploads are buffered now because the request is gone by the time a worker runs
+        uploads = [(file.filename, file.read()) for file in request.files.getlist('file') if file.filename]
+
+        job = job_queue.submit(run_generation_job, current_app._get_current_object(), client_id(), prompt, uploads,
+                               request.form.getlist('url'),
+                               pdf_pages=request.form.get('pdf_pages', '').strip() or None,
+                               bypass_cache=wants_fresh_script(),
+                               long_document=wants_long_document())
+
+        return jsonify({
+            "success": True,
+            "job_id": job.id,
+            "status": job.status,
+            "queue_depth": job_queue.stats()['queue_depth']
+        }), 202
+
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": str(e)}), 503
+    except Exception as e:
+        logging.error(f"Error submitting job: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@bp.route('/jobs', methods=['GET'])
+def job_stats():
+    return jsonify({"success": True, **job_queue.stats()})
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+@bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if not job_queue.get(job_id):
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({"success": False, "error": "Job already finished"}), 409
+    return jsonify({"success": True, "job_id": job_id, "status": "cancelled"})
+
+def run_batch_item(index, item, client, bypass_cache=False):
+    """Generate one batch item under the shared rate and concurrency limits, returning its result record"""
+    started = time.perf_counter()
+    record = {"index": index, "id": item.get('id', index)}
+    prompt = str(item.get('prompt', '')).strip()
+    if not prompt:
+        return {**record, "success": False, "error": "No prompt provided"}
+
+    try:
+        urls = item.get('urls') or []
+        _, additional_context, timings = collect_generation_inputs(
+            prompt, urls=[urls] if isinstance(urls, str) else urls, texts=[str(item.get('context') or '')])
+
+        cache_key = response_cache_key(prompt, None, additional_context)
+        script = None if bypass_cache else response_cache.get(cache_key)
+        if script is not None:
+            record["cached"] = True
+        else:
+            # Cached items skip the scheduler entirely; model calls pay their estimated token cost
+            cost = estimate_tokens(SYSTEM_PROMPT + prompt + additional_context) + current_app.config['BATCH_OUTPUT_TOKENS']
+            for attempt in range(current_app.config['BATCH_MAX_RETRIES'] + 1):
+                timings['queued_ms'] = round(timings.get('queued_ms', 0) + rate_scheduler.acquire(cost) * 1000, 1)
+                try:
+                    with generation_slot(client):
+                        script = request_script(prompt, None, additional_context, retry_rate_limits=False)
+                    rate_scheduler.record_success()
+                    break
+                except Exception as e:
+                    if not is_rate_limited(e) or attempt == current_app.config['BATCH_MAX_RETRIES']:
+                        raise
+                    rate_scheduler.record_rate_limit(retry_after(e, 2 ** attempt) + random.uniform(0, 0.5))
+
+        timings['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return {**record, "success": True, "script": script, "timings": timings}
+
+    except Exception as e:
+        logging.error(f"Batch item {record['id']} failed: {str(e)}")
+        return {**record, "success": False, "error": str(e)}
+
+@bp.route('/generate_batch', methods=['POST'])
+def generate_batch():
+    """
+    Generate scripts for many items concurrently, streaming each result as it completes.
+
+    Expects JSON `{"items": [{"id", "prompt", "context", "urls"}, ...], "fresh": false}`.
+    Results are newline-delimited JSON in completion order (or SSE `item`
+    events with `Accept: text/event-stream`), followed by a summary record.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "error": "No items provided"}), 400
+    if len(items) > current_app.config['BATCH_MAX_ITEMS']:
+        return jsonify({"success": False, "error": f"At most {current_app.config['BATCH_MAX_ITEMS']} items per batch"}), 400
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({"success": False, "error": "Each item must be an object"}), 400
+
+    bypass_cache = bool(data.get('fresh'))
+    client = client_id()
+    futures = [submit_traced(batch_pool, run_batch_item, i, item, client, bypass_cache) for i, item in enumerate(items)]
+    sse = wants_event_stream()
+
+    def frame(event, payload):
+        return format_sse(event, payload) if sse else json.dumps(payload) + "\n"
+
+    def result_stream():
+        started = time.perf_counter()
+        succeeded = 0
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                succeeded += result["success"]
+                yield frame("item", result)
+            yield frame("done", {
+                "done": True,
+                "total": len(futures),
+                "succeeded": succeeded,
+                "failed": len(futures) - succeeded,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+                "rate_limits": rate_scheduler.get_stats()
+            })
+        finally:
+            # A client that disconnects early shouldn't keep spending quota
+            for future in futures:
+                future.cancel()
+
+    return Response(
+        stream_with_context(result_stream()),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def loaded_stats(service):
+    """A subsystem's stats, or None if nothing has used it yet (so reporting never loads it)"""
+    return service.get_stats() if service.loaded else None
+
+@bp.route('/cache/stats')
+def cache_stats():
+    return jsonify({
+        "success": True,
+        "responses": loaded_stats(response_cache),
+        "urls": loaded_stats(url_fetcher),
+        "ocr": loaded_stats(ocr_cache),
+        "summaries": loaded_stats(document_summarizer),
+        "llm": loaded_stats(llm),
+        "coalescing": loaded_stats(generation_flights),
+        "admission": loaded_stats(admission)
+    })
+
+def cache_counts():
+    """Hits and misses per cache, in the shape of a labelled counter"""
+    counts = {}
+    responses = loaded_stats(response_cache)
+    if responses:
+        counts['responses'] = (responses['memory_hits'] + responses['disk_hits'], responses['misses'])
+    urls = loaded_stats(url_fetcher)
+    if urls:
+        counts['urls'] = (urls['hits'] + urls['revalidated'], urls['fetches'] - urls['revalidated'])
+    ocr_stats = loaded_stats(ocr_cache)
+    if ocr_stats:
+        counts['ocr'] = (ocr_stats['exact_hits'] + ocr_stats['perceptual_hits'], ocr_stats['misses'])
+    summaries = loaded_stats(document_summarizer)
+    if summaries:
+        counts['summaries'] = (summaries['cache_hits'], summaries['chunks'] - summaries['cache_hits'])
+    samples = {}
+    for cache, (hits, misses) in counts.items():
+        samples[(cache, 'hit')] = hits
+        samples[(cache, 'miss')] = misses
+    return samples
+
+def cache_hit_ratios():
+    samples = cache_counts()
+    ratios = {}
+    for cache in {cache for cache, _ in samples}:
+        total = samples[(cache, 'hit')] + samples[(cache, 'miss')]
+        ratios[(cache,)] = samples[(cache, 'hit')] / total if total else None
+    return ratios
+
+metrics.registry.gauge_callback(
+    'app_cache_requests_total', 'Cache lookups by cache and result', cache_counts,
+    ['cache', 'result'], kind='counter')
+metrics.registry.gauge_callback(
+    'app_cache_hit_ratio', 'Share of cache lookups served from the cache', cache_hit_ratios, ['cache'])
+metrics.registry.gauge_callback(
+    'app_queue_depth', 'Work waiting for a worker', lambda: {
+        ('jobs',): job_queue.stats()['queue_depth'] if job_queue.loaded else 0,
+        ('pdf_render',): pdf_renderer.queue_depth() if pdf_renderer.loaded else 0,
+    }, ['queue'])
+metrics.registry.gauge_callback(
+    'app_jobs_running', 'Background generation jobs currently running',
+    lambda: {(): job_queue.stats()['running'] if job_queue.loaded else 0})
+metrics.registry.gauge_callback(
+    'app_llm_rate_factor', 'Share of the configured Groq quota the batch scheduler currently allows',
+    lambda: {(): rate_scheduler.get_stats()['rate_factor'] if rate_scheduler.loaded else 1.0})
+metrics.registry.gauge_callback(
+    'app_llm_calls_total', 'Model calls and their retries, fallbacks and failures',
+    lambda: {(name,): value for name, value in (loaded_stats(llm) or {}).items()
+             if name in ('calls', 'retries', 'fallbacks', 'hedges', 'hedge_wins', 'failures')},
+    ['event'], kind='counter')
+metrics.registry.gauge_callback(
+    'app_generations_running', 'Generation requests and background model calls currently holding an admission slot',
+    lambda: {(): admission.get_stats()['running'] if admission.loaded else 0})
+metrics.registry.gauge_callback(
+    'app_generations_rejected_total', 'Generation requests turned away with a 429, by the limit they hit',
+    lambda: {(limit,): admission.get_stats()[f'rejected_{limit}'] if admission.loaded else 0
+             for limit in ('global', 'client')},
+    ['limit'], kind='counter')
+metrics.registry.gauge_callback(
+    'app_generations_coalesced_total', 'Generations that joined an identical one in progress instead of calling the model',
+    lambda: {(): generation_flights.get_stats()['coalesced'] if generation_flights.loaded else 0}, kind='counter')
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.before_app_request
+def start_request_trace():
+    g.trace = metrics.start_trace()
+
+# Endpoints that hold a generation slot from the start of the request until its response is fully sent.
+# Batches and jobs make many model calls, so they take a slot around each one instead (generation_slot)
+ADMISSION_ENDPOINTS = {'main.generate_script', 'main.generate_script_stream'}
+
+def client_id():
+    """The address per-client limits count against (behind a proxy, set PROXY_FIX_HOPS)"""
+    return request.remote_addr or 'unknown'
+
+@contextmanager
+def generation_slot(client):
+    """Hold a generation slot for `client` around one background model call, waiting for one if needed"""
+    ticket = admission.acquire(client, wait=current_app.config['GENERATE_SLOT_WAIT'])
+    try:
+        yield
+    finally:
+        admission.release(ticket)
+
+@bp.before_app_request
+def admit_generation():
+    # Checked before the body is read, so a rejection costs next to nothing
+    if request.endpoint in ADMISSION_ENDPOINTS:
+        g.admission_ticket = admission.acquire(client_id())
+
+@bp.teardown_app_request
+def release_generation(exc):
+    # Streamed responses keep the request context, and so the slot, until the stream ends
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        admission.release(ticket)
+
+@bp.after_app_request
+def report_request_trace(response):
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    # Streamed bodies are still being produced here; their stages only reach /metrics
+    response.headers['Server-Timing'] = trace.server_timing()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - trace.started, route, request.method,
+                                    str(response.status_code))
+    return response
+
 def extract_title(title_text):
     """
     Extract only the first sentence as the title, handling multiple sentence endings.
@@ -398,13 +1323,8 @@ def extract_title(title_text):
     
     return title or "Untitled Script"
 
-def save_script_metadata(filename, script_data):
+def save_script_metadata(filename, script_data, pdf_hash=None):
     try:
-        metadata = []
-        if os.path.exists(SCRIPTS_METADATA_FILE):
-            with open(SCRIPTS_METADATA_FILE, 'r') as f:
-                metadata = json.load(f)
-        
         # Get the raw title from the first section or script data
         raw_title = ''
         sections = script_data.get('metadata', {}).get('unformatted_sections', [])
@@ -423,183 +1343,133 @@ def save_script_metadata(filename, script_data):
             'timestamp': datetime.now().isoformat(),  # Always use current time
             'preview': script_data.get('script', '')[:200] + '...' if len(script_data.get('script', '')) > 200 else script_data.get('script', ''),
             'sections': script_data.get('metadata', {}).get('unformatted_sections', []),
-            'formatted_html': script_data.get('metadata', {}).get('formatted_html', '')
+            'formatted_html': script_data.get('metadata', {}).get('formatted_html', ''),
+            'pdf_hash': pdf_hash
         }
         
-        # Insert at the beginning of the list
-        metadata.insert(0, new_entry)
-        
-        with open(SCRIPTS_METADATA_FILE, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        script_store.add(new_entry)
     except Exception as e:
         logging.error(f"Error saving metadata: {str(e)}")
 
-@app.route('/saved_scripts')
+@bp.route('/saved_scripts')
 def view_saved_scripts():
     try:
-        if os.path.exists(SCRIPTS_METADATA_FILE):
-            with open(SCRIPTS_METADATA_FILE, 'r') as f:
-                metadata = json.load(f)
-                # Sort metadata by timestamp in descending order (newest first)
-                metadata.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            return render_template('saved_scripts.html', scripts=metadata)
-        return render_template('saved_scripts.html', scripts=[])
+        # Only the first page is rendered; the rest is loaded from /api/scripts on scroll
+        scripts, next_cursor = script_store.list_page(limit=current_app.config['SCRIPTS_PAGE_SIZE'])
+        return render_template('saved_scripts.html', scripts=scripts, next_cursor=next_cursor)
     except Exception as e:
         logging.error(f"Error loading saved scripts: {str(e)}")
         return render_template('saved_scripts.html', scripts=[], error=str(e))
 
-@app.route('/download_script/<filename>')
+@bp.route('/api/scripts')
+def list_scripts_api():
+    """Paginated listing of saved scripts (title, preview and timestamp only)"""
+    try:
+        limit = min(max(request.args.get('limit', current_app.config['SCRIPTS_PAGE_SIZE'], type=int), 1), 100)
+        scripts, next_cursor = script_store.list_page(limit=limit, cursor=request.args.get('cursor'))
+        return jsonify({
+            "success": True,
+            "scripts": scripts,
+            "next_cursor": next_cursor
+        })
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error listing scripts: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@bp.route('/search')
+def search_scripts():
+    """Ranked full-text search over saved scripts"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"success": False, "error": "No search query provided"}), 400
+
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        started = time.perf_counter()
+        results, total = script_store.search(query, page=page, per_page=per_page)
+
+        return jsonify({
+            "success": True,
+            "query": query,
+            "results": results,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "has_more": page * per_page < total,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        })
+    except Exception as e:
+        logging.error(f"Error searching scripts: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+def ensure_pdf_render(script_data):
+    """
+    Status of a script's shared PDF, re-queuing the render if it was lost.
+
+    A failed render is reported as failed, not queued again on every poll;
+    the render pool has already retried it if a worker crashed. If the
+    re-parsed content hashes differently, the script's pdf_hash (in the
+    store and in `script_data`) is moved to the new render.
+    """
+    import pdf_render
+    pdf_hash = script_data['pdf_hash']
+    status = pdf_renderer.status(pdf_hash)
+    if status == pdf_render.MISSING:
+        # e.g. the render was in flight when the server restarted
+        content = script_store.get_content(script_data['filename'])
+        rendered_hash = pdf_renderer.submit(parse_html_content(content['formatted_html']))
+        if rendered_hash != pdf_hash:
+            logger.info(f"Re-rendered content of {script_data['filename']} changed, now PDF {rendered_hash[:12]}")
+            script_store.set_pdf_hash(script_data['filename'], rendered_hash)
+            script_data['pdf_hash'] = rendered_hash
+        status = pdf_renderer.status(rendered_hash)
+    return status
+
+@bp.route('/script_status/<filename>')
+def script_status(filename):
+    """Poll whether a saved script's PDF is ready to download"""
+    import pdf_render
+    script_data = script_store.get(filename)
+    if not script_data:
+        return jsonify({"success": False, "error": "Script not found"}), 404
+    status = ensure_pdf_render(script_data) if script_data.get('pdf_hash') else pdf_render.READY
+    return jsonify({"success": True, "filename": filename, "status": status})
+
+@bp.route('/download_script/<filename>')
 def download_script(filename):
+    import pdf_render
     try:
-        return send_from_directory('saved_scripts', filename, as_attachment=True)
+        script_data = script_store.get(filename)
+        if not script_data or not script_data.get('pdf_hash'):
+            # Scripts saved before content-addressed rendering keep their own file
+            return send_from_directory('saved_scripts', filename, as_attachment=True)
+
+        status = ensure_pdf_render(script_data)
+        pdf_hash = script_data['pdf_hash']
+        if status == pdf_render.PENDING:
+            with stage('pdf_wait'):
+                status = pdf_renderer.wait(pdf_hash, timeout=current_app.config['PDF_DOWNLOAD_WAIT'])
+        if status == pdf_render.FAILED:
+            return jsonify({"success": False, "status": status, "error": "PDF rendering failed"}), 500
+        if status != pdf_render.READY:
+            response = jsonify({"success": False, "status": status, "error": "PDF is still rendering"})
+            response.headers['Retry-After'] = '2'
+            return response, 202
+
+        return send_from_directory(pdf_renderer.output_dir, f'{pdf_hash}.pdf',
+                                   as_attachment=True, download_name=filename)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 404
 
 def parse_html_content(formatted_html):
     """Parse HTML content and extract structured content"""
-    soup = BeautifulSoup(formatted_html, 'html.parser')
-    content_structure = []
-    
-    # Find all direct children of the main div
-    main_div = soup.find('div', class_='space-y-6')
-    if (main_div):
-        for element in main_div.children:
-            if element.name == 'h3':
-                # Extract section headers
-                dot_span = element.find('span', class_='bg-blue-600')
-                text_span = element.find_all('span')[-1]
-                content_structure.append({
-                    'type': 'header',
-                    'content': text_span.get_text().strip()
-                })
-            elif element.name == 'p':
-                # Extract paragraphs with formatting
-                formatted_text = ''
-                for child in element.children:
-                    if child.name == 'strong':
-                        formatted_text += f'<b>{child.get_text()}</b>'
-                    elif child.name == 'i':
-                        formatted_text += f'<i>{child.get_text()}</i>'
-                    else:
-                        formatted_text += str(child)
-                content_structure.append({
-                    'type': 'paragraph',
-                    'content': formatted_text.strip()
-                })
-    
-    return content_structure
-
-def create_styled_pdf(content_structure, filepath):
-    """Create PDF with consistent margins and padding"""
-    # A4 size in mm: 210 x 297
-    margin = 20  # Consistent margin of 20mm on all sides
-    
-    pdf = FPDF(format='A4')
-    # Set consistent margins (left, top, right) in mm
-    pdf.set_margins(margin, margin, margin)
-    # Set auto page break with bottom margin
-    pdf.set_auto_page_break(True, margin)
-    
-    pdf.add_page()
-    
-    # Calculate effective page width (A4 width - margins)
-    effective_width = 210 - (2 * margin)
-    
-    # Add title with proper positioning
-    pdf.set_font("Arial", 'B', 24)
-    title_height = 15
-    pdf.cell(effective_width, title_height, "Generated Video Script", ln=True, align='C')
-    pdf.ln(5)
-    
-    # Add timestamp with proper alignment
-    pdf.set_font("Arial", 'I', 11)
-    pdf.set_text_color(100, 100, 100)
-    timestamp_text = f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    pdf.cell(effective_width, 8, timestamp_text, ln=True, align='R')
-    pdf.ln(10)
-    
-    # Reset text color
-    pdf.set_text_color(0, 0, 0)
-    
-    # Process content with consistent spacing
-    for item in content_structure:
-        if item['type'] == 'header':
-            pdf.set_font("Arial", 'B', 14)
-            # Add section header with consistent indentation
-            pdf.cell(6, 10, "-", 0, 0, 'R')  # Bullet point
-            try:
-                header_text = item['content'].encode('latin-1', 'ignore').decode('latin-1')
-                pdf.multi_cell(effective_width - 6, 10, header_text, 0)
-            except Exception:
-                header_text = item['content'].encode('ascii', 'ignore').decode('ascii')
-                pdf.multi_cell(effective_width - 6, 10, header_text, 0)
-            pdf.ln(2)
-            
-        elif item['type'] == 'paragraph':
-            pdf.set_font("Arial", '', 12)
-            text = item['content']
-            
-            if '<' in text:  # Handle formatted text
-                parts = text.split('<')
-                line_height = pdf.font_size * 1.5
-                current_y = pdf.get_y()
-                
-                formatted_text = ''
-                for part in parts:
-                    if not part:
-                        continue
-                    
-                    if part.startswith('b>'):
-                        formatted_text += part[2:].split('</b>')[0]
-                    elif part.startswith('i>'):
-                        formatted_text += part[2:].split('</i>')[0]
-                    else:
-                        formatted_text += str(part)
-                
-                try:
-                    safe_text = formatted_text.encode('latin-1', 'ignore').decode('latin-1')
-                    pdf.multi_cell(effective_width, line_height, safe_text)
-                except Exception:
-                    safe_text = formatted_text.encode('ascii', 'ignore').decode('ascii')
-                    pdf.multi_cell(effective_width, line_height, safe_text)
-            else:
-                try:
-                    safe_text = text.encode('latin-1', 'ignore').decode('latin-1')
-                    pdf.multi_cell(effective_width, 8, safe_text)
-                except Exception:
-                    pdf.multi_cell(effective_width, 8, text.encode('ascii', 'ignore').decode('ascii'))
-            
-            pdf.ln(4)
-    
-    try:
-        # Add page numbers at the bottom with consistent margins
-        page_numbers = pdf.page_no()
-        for page in range(1, page_numbers + 1):
-            pdf.page = page
-            pdf.set_y(-margin - 10)  # Position 10mm above bottom margin
-            pdf.set_font('Arial', 'I', 8)
-            pdf.cell(effective_width, 10, f'Page {page}/{page_numbers}', 0, 0, 'C')
-        
-        pdf.output(filepath)
-    except Exception as e:
-        logging.error(f"Error in PDF generation: {str(e)}")
-        pdf = FPDF(format='A4')
-        pdf.set_margins(margin, margin, margin)
-        pdf.set_auto_page_break(True, margin)
-        pdf.add_page()
-        
-        pdf.set_font("Arial", 'B', 16)
-        pdf.cell(effective_width, 10, "Generated Video Script", ln=True, align='C')
-        pdf.set_font("Arial", '', 12)
-        
-        for item in content_structure:
-            text = item['content'].encode('ascii', 'ignore').decode('ascii')
-            pdf.multi_cell(effective_width, 10, text)
-            pdf.ln(5)
-        
-        pdf.output(filepath)
+    from html_extract import parse_script_html
+    return parse_script_html(formatted_html)
 
-@app.route('/save_script', methods=['POST'])
+@bp.route('/save_script', methods=['POST'])
 def save_script():
     try:
         script_data = request.get_json()
@@ -610,20 +1480,21 @@ def save_script():
 
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'{timestamp}_script.pdf'
-        filepath = os.path.join('saved_scripts', filename)
-
-        if not os.path.exists('saved_scripts'):
-            os.makedirs('saved_scripts')
 
-        content_structure = parse_html_content(formatted_html)
+        with stage('parse_html'):
+            content_structure = parse_html_content(formatted_html)
         
-        create_styled_pdf(content_structure, filepath)
+        # Rendering happens in the background; identical content shares one PDF
+        with stage('pdf_submit'):
+            pdf_hash = pdf_renderer.submit(content_structure)
         
-        save_script_metadata(filename, script_data)
+        with stage('metadata_save'):
+            save_script_metadata(filename, script_data, pdf_hash)
 
         return jsonify({
             "success": True,
-            "filename": filename
+            "filename": filename,
+            "status": pdf_renderer.status(pdf_hash)
         })
 
     except Exception as e:
@@ -633,45 +1504,42 @@ def save_script():
             "error": str(e)
         }), 500
 
-@app.route('/get_script_content/<filename>')
+@bp.route('/get_script_content/<filename>')
 def get_script_content(filename):
     try:
-        script_path = os.path.join('saved_scripts', filename)
-        if not os.path.exists(script_path):
-            return jsonify({"success": False, "error": "Script not found"}), 404
-
-        with open(SCRIPTS_METADATA_FILE, 'r') as f:
-            metadata = json.load(f)
-            
-        script_data = next((s for s in metadata if s['filename'] == filename), None)
+        script_data = script_store.get_content(filename)
         if not script_data:
-            return jsonify({"success": False, "error": "Metadata not found"}), 404
+            return jsonify({"success": False, "error": "Script not found"}), 404
 
         return jsonify({
             "success": True,
             "content": script_data['formatted_html'],
-            "title": script_data['title']
+            "title": script_data['title'],
+            "timestamp": script_data['timestamp']
         })
 
     except Exception as e:
         logging.error(f"Error getting script content: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
-@app.route('/delete_script/<filename>', methods=['DELETE'])
+@bp.route('/delete_script/<filename>', methods=['DELETE'])
 def delete_script(filename):
     try:
+        script_data = script_store.get(filename)
+
         script_path = os.path.join('saved_scripts', filename)
         if os.path.exists(script_path):
             os.remove(script_path)
 
         # Update metadata
-        with open(SCRIPTS_METADATA_FILE, 'r') as f:
-            metadata = json.load(f)
-        
-        metadata = [s for s in metadata if s['filename'] != filename]
-        
-        with open(SCRIPTS_METADATA_FILE, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        script_store.delete(filename)
+
+        # Remove the shared PDF once no other script uses it
+        pdf_hash = script_data.get('pdf_hash') if script_data else None
+        if pdf_hash and not script_store.count_pdf_references(pdf_hash):
+            pdf_path = pdf_renderer.path_for(pdf_hash)
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
 
         return jsonify({"success": True})
 
@@ -680,7 +1548,7 @@ def delete_script(filename):
         return jsonify({"success": False, "error": str(e)}), 500
 
 # Add template filter for datetime formatting
-@app.template_filter('datetime')
+@bp.app_template_filter('datetime')
 def format_datetime(value):
     try:
         dt = datetime.fromisoformat(value)
@@ -688,19 +1556,28 @@ def format_datetime(value):
     except:
         return value
 
-@app.errorhandler(413)
+@bp.app_errorhandler(413)
 def too_large(e):
     return jsonify({
         "success": False,
         "error": "File is too large"
     }), 413
 
-@app.errorhandler(500)
+@bp.app_errorhandler(OverCapacityError)
+def over_capacity(e):
+    return jsonify({
+        "success": False,
+        "error": str(e),
+        "retry_after": e.retry_after
+    }), 429, {'Retry-After': str(e.retry_after)}
+
+@bp.app_errorhandler(500)
 def server_error(e):
     return jsonify({
         "success": False,
         "error": "Internal server error"
     }), 500
 
+# `flask run` and gunicorn (`app:create_app()`) call the factory themselves
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,351 @@
+"""
+Load test that replays a request corpus against the app with a stubbed LLM.
+
+    python benchmarks/load_test.py --concurrency 16 --duration 30
+    python benchmarks/load_test.py --rate 20 --requests 500 --stub-latency 1.5
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --mix generate=1
+
+Without --url, the app is started in-process on a threaded local server,
+with LLM_PROVIDER=stub and its caches and stores in a temp dir; against
+an external server, start it with LLM_PROVIDER=stub yourself.
+
+Prompts come from benchmarks/prompts.jsonl (or --corpus), uploads from
+static/examples, and saved scripts from saved_scripts/scripts_metadata.json.
+By default workers send requests back to back (closed loop). With --rate,
+requests arrive as a Poisson process at that many per second (open loop). Latency is then
+measured from each request's scheduled arrival, so queueing inside the
+load generator counts against the server.
+
+The report gives throughput, p50/p95/p99/max latency per route, and
+error rates. Requests turned away by the server's concurrency limits show
+up as 429s in the failures by status.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(ROOT, 'static', 'examples')
+DEFAULT_CORPUS = os.path.join(ROOT, 'benchmarks', 'prompts.jsonl')
+DEFAULT_MIX = 'generate=6,generate_upload=2,save=2,list=1,search=1'
+
+
+def load_prompts(path):
+    """Prompts built from the title and body of each corpus line"""
+    prompts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            title = entry.get('title', '')
+            body = entry.get('body', '')
+            prompts.append(f"Create a short explainer video script about: {title}\n\n{body[:1500]}".strip())
+    return prompts
+
+
+def load_uploads():
+    """(filename, bytes, mimetype) for each example file"""
+    types = {'.txt': 'text/plain', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+             '.pdf': 'application/pdf'}
+    uploads = []
+    for name in sorted(os.listdir(EXAMPLES_DIR)):
+        mimetype = types.get(os.path.splitext(name)[1].lower())
+        if mimetype:
+            with open(os.path.join(EXAMPLES_DIR, name), 'rb') as f:
+                uploads.append((name, f.read(), mimetype))
+    return uploads
+
+
+def load_saved_scripts():
+    with open(os.path.join(ROOT, 'saved_scripts', 'scripts_metadata.json'), 'r') as f:
+        return json.load(f)
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(ROUTES)
+    if unknown:
+        raise SystemExit(f"Unknown routes in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class Corpus:
+    def __init__(self, prompts, uploads, saved, fresh=False):
+        self.prompts = prompts
+        self.fresh = fresh
+        self.uploads = uploads
+        self.saved = saved
+        self.rng = random.Random(1234)
+        self._lock = threading.Lock()
+
+    def generation_form(self):
+        form = {'prompt': self.pick(self.prompts)}
+        if self.fresh:
+            form['fresh'] = '1'
+        return form
+
+    def pick(self, items):
+        with self._lock:
+            return self.rng.choice(items)
+
+
+# Each route builds and sends one request: func(session, base_url, corpus) -> response
+def send_generate(session, base_url, corpus):
+    return session.post(f'{base_url}/generate_script', data=corpus.generation_form(), timeout=120)
+
+
+def send_generate_upload(session, base_url, corpus):
+    name, data, mimetype = corpus.pick(corpus.uploads)
+    return session.post(f'{base_url}/generate_script', data=corpus.generation_form(),
+                        files={'file': (name, data, mimetype)}, timeout=120)
+
+
+def send_save(session, base_url, corpus):
+    sample = corpus.pick(corpus.saved)
+    prompt = corpus.pick(corpus.prompts).split('\n', 1)[0]
+    # A unique paragraph per request, so content-hash dedup doesn't skip every render
+    marker = f'<p class="mb-4">{prompt} ({random.random():.12f})</p>'
+    html = sample['formatted_html'].replace('<div class="space-y-6">', f'<div class="space-y-6">{marker}', 1)
+    payload = {
+        'script': sample.get('preview', ''),
+        'title': sample.get('title', ''),
+        'metadata': {
+            'formatted_html': html,
+            'unformatted_sections': sample.get('sections', []),
+            'version': '1.0',
+        },
+    }
+    return session.post(f'{base_url}/save_script', json=payload, timeout=60)
+
+
+def send_list(session, base_url, corpus):
+    return session.get(f'{base_url}/api/scripts', params={'limit': 24}, timeout=30)
+
+
+def send_search(session, base_url, corpus):
+    words = [word for word in corpus.pick(corpus.prompts).split() if len(word) > 4]
+    return session.get(f'{base_url}/search', params={'q': ' '.join(words[:2]) or 'video'}, timeout=30)
+
+
+ROUTES = {
+    'generate': send_generate,
+    'generate_upload': send_generate_upload,
+    'save': send_save,
+    'list': send_list,
+    'search': send_search,
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, latency, ok, status):
+        with self._lock:
+            self.samples.setdefault(route, []).append((latency, ok, status))
+
+    def report(self, elapsed):
+        rows = {}
+        all_latencies = []
+        total = errors = 0
+        for route, samples in sorted(self.samples.items()):
+            latencies = sorted(latency for latency, _, _ in samples)
+            failed = sum(1 for _, ok, _ in samples if not ok)
+            statuses = {}
+            for _, _, status in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            rows[route] = {
+                'requests': len(samples),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'error_rate': round(failed / len(samples), 4),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+                'statuses': statuses,
+            }
+            all_latencies.extend(latencies)
+            total += len(samples)
+            errors += failed
+        all_latencies.sort()
+        overall = {
+            'requests': total,
+            'elapsed_s': round(elapsed, 2),
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+            'error_rate': round(errors / total, 4) if total else 0.0,
+            'p50_ms': round(percentile(all_latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(all_latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(all_latencies, 0.99) * 1000, 1),
+        }
+        return {'overall': overall, 'routes': rows}
+
+
+def worker(base_url, corpus, recorder, jobs, stop):
+    session = requests.Session()
+    while not stop.is_set():
+        try:
+            route, scheduled = jobs.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if route is None:
+            return
+        start = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            response = ROUTES[route](session, base_url, corpus)
+            ok = response.status_code < 400
+            if ok and response.headers.get('Content-Type', '').startswith('application/json'):
+                ok = response.json().get('success', True) is not False
+            status = response.status_code
+        except requests.RequestException as e:
+            ok, status = False, type(e).__name__
+        recorder.record(route, time.perf_counter() - start, ok, status)
+
+
+def run(base_url, corpus, mix, concurrency, rate=None, duration=None, total_requests=None):
+    recorder = Recorder()
+    routes, weights = zip(*mix.items())
+    rng = random.Random(42)
+    stop = threading.Event()
+    # Closed loop keeps exactly one request per worker in flight; open loop queues arrivals
+    jobs = queue.Queue(maxsize=0 if rate else concurrency)
+    threads = [threading.Thread(target=worker, args=(base_url, corpus, recorder, jobs, stop), daemon=True)
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+    sent = 0
+    next_arrival = started
+    while True:
+        if total_requests is not None and sent >= total_requests:
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        route = rng.choices(routes, weights)[0]
+        if rate:
+            next_arrival += rng.expovariate(rate)
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            jobs.put((route, next_arrival))
+        else:
+            jobs.put((route, None))
+        sent += 1
+
+    for _ in threads:
+        jobs.put((None, None))
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.perf_counter() - started)
+
+
+def start_local_server(args):
+    """Run the app on a threaded werkzeug server in this process, returning its base URL"""
+    workdir = tempfile.mkdtemp(prefix='script-loadtest-')
+    os.environ['LLM_PROVIDER'] = 'stub'
+    os.environ['STUB_LATENCY'] = str(args.stub_latency)
+    os.environ['STUB_TOKEN_DELAY'] = str(args.stub_token_delay)
+    os.environ.setdefault('RESPONSE_CACHE_DIR', os.path.join(workdir, 'responses'))
+    os.environ.setdefault('SUMMARY_CACHE_DIR', os.path.join(workdir, 'summaries'))
+    os.environ.setdefault('OCR_CACHE_PATH', os.path.join(workdir, 'ocr.sqlite3'))
+    os.environ.setdefault('SCRIPTS_DB_FILE', os.path.join(workdir, 'scripts.sqlite3'))
+    os.environ.setdefault('PDF_RENDER_DIR', os.path.join(workdir, 'rendered'))
+    # Every worker connects from 127.0.0.1, so only the global generation limit applies
+    os.environ.setdefault('GENERATE_MAX_PER_CLIENT', '0')
+    # Per-request INFO logging would dominate the measurement; create_app()
+    # configures the root logger from LOG_LEVEL, so set it before building the app
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, ROOT)
+
+    import logging
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    flask_app = app_module.create_app()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def print_report(report):
+    print(f"\n{'route':<18} {'reqs':>6} {'rps':>7} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for route, row in report['routes'].items():
+        print(f"{route:<18} {row['requests']:>6} {row['throughput_rps']:>7.2f} {row['error_rate'] * 100:>5.1f}% "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    overall = report['overall']
+    print(f"{'all':<18} {overall['requests']:>6} {overall['throughput_rps']:>7.2f} {overall['error_rate'] * 100:>5.1f}% "
+          f"{overall['p50_ms']:>9.1f} {overall['p95_ms']:>9.1f} {overall['p99_ms']:>9.1f}")
+    for route, row in report['routes'].items():
+        failures = {status: count for status, count in row['statuses'].items() if not status.startswith(('2', '3'))}
+        if failures:
+            print(f"  {route} failures by status: {failures}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running server (default: start the app in-process)')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='JSONL file of requests with title and body')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'route weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent client workers')
+    parser.add_argument('--rate', type=float, help='open-loop arrival rate in requests per second')
+    parser.add_argument('--duration', type=float, help='seconds to run (default 20 unless --requests is given)')
+    parser.add_argument('--requests', type=int, dest='total_requests', help='stop after this many requests')
+    parser.add_argument('--stub-latency', type=float, default=0.8, help='stub LLM time to first token, seconds')
+    parser.add_argument('--stub-token-delay', type=float, default=0.005, help='stub LLM delay per word, seconds')
+    parser.add_argument('--fresh', action='store_true',
+                        help='bypass the response cache so every generation reaches the (stub) LLM')
+    parser.add_argument('--json', dest='json_path', help='also write the report to this file')
+    args = parser.parse_args()
+
+    if args.duration is None and args.total_requests is None:
+        args.duration = 20
+
+    corpus = Corpus(load_prompts(args.corpus), load_uploads(), load_saved_scripts(), fresh=args.fresh)
+    mix = parse_mix(args.mix)
+    base_url = args.url.rstrip('/') if args.url else start_local_server(args)
+
+    mode = f"open loop at {args.rate}/s" if args.rate else "closed loop"
+    print(f"Load testing {base_url} with {args.concurrency} workers, {mode}, mix {args.mix}")
+    report = run(base_url, corpus, mix, args.concurrency, rate=args.rate,
+                 duration=args.duration, total_requests=args.total_requests)
+    report['config'] = {
+        'url': args.url or 'in-process',
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'fresh': args.fresh,
+        'mix': mix,
+        'stub_latency': args.stub_latency if not args.url else None,
+    }
+    print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+Offline micro-benchmarks for the CPU-bound stages of the request pipeline.
+
+    python benchmarks/run_benchmarks.py                  # run and compare with the baseline
+    python benchmarks/run_benchmarks.py --save-baseline  # record new baseline numbers
+    python benchmarks/run_benchmarks.py --quick -k pdf   # fewer repeats, matching cases only
+
+Inputs are the samples in static/examples and saved_scripts plus generated
+large and adversarial cases. Each case reports the median and minimum of
+several timed runs; a median more than --threshold slower than the
+baseline is flagged as a regression and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+EXAMPLES_DIR = os.path.join(ROOT, 'static', 'examples')
+SAVED_SCRIPTS_DIR = os.path.join(ROOT, 'saved_scripts')
+
+WORKDIR = tempfile.mkdtemp(prefix='script-bench-')
+
+# Keep the app's caches and stores out of the working tree, and never touch the network
+os.environ.setdefault('LLM_PROVIDER', 'stub')
+os.environ.setdefault('RESPONSE_CACHE_DIR', os.path.join(WORKDIR, 'responses'))
+os.environ.setdefault('SUMMARY_CACHE_DIR', os.path.join(WORKDIR, 'summaries'))
+os.environ.setdefault('OCR_CACHE_PATH', os.path.join(WORKDIR, 'ocr.sqlite3'))
+os.environ.setdefault('SCRIPTS_DB_FILE', os.path.join(WORKDIR, 'scripts.sqlite3'))
+os.environ.setdefault('PDF_RENDER_DIR', os.path.join(WORKDIR, 'rendered'))
+
+sys.path.insert(0, ROOT)
+
+
+def measure(func, repeat, min_time=0.05):
+    """Median and minimum milliseconds per call; fast functions are looped so each sample lasts min_time"""
+    func()  # warm up caches and lazy imports
+    start = time.perf_counter()
+    func()
+    single = time.perf_counter() - start
+    loops = max(1, int(min_time / single)) if single < min_time else 1
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - start) / loops * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def load_saved_entries():
+    with open(os.path.join(SAVED_SCRIPTS_DIR, 'scripts_metadata.json'), 'r') as f:
+        return json.load(f)
+
+
+def synthetic_entries(samples, count):
+    """`count` distinct metadata entries built by cycling the saved samples"""
+    entries = []
+    for i in range(count):
+        sample = samples[i % len(samples)]
+        entries.append({
+            **sample,
+            'filename': f'bench_{i:06d}_script.pdf',
+            'timestamp': f'2025-01-01T00:00:00.{i:06d}',
+            'title': f"{sample.get('title', '')} #{i}",
+        })
+    return entries
+
+
+def large_html(samples, copies):
+    """One formatted script made of many saved scripts' bodies"""
+    inner = ''.join(entry['formatted_html'].strip()[len('<div class="space-y-6">'):-len('</div>')]
+                    for entry in samples)
+    return f'<div class="space-y-6">{inner * copies}</div>'
+
+
+def web_page(paragraphs, script_blocks=0, depth=0):
+    """A synthetic article page: boilerplate, optional inline scripts and nesting, then body text"""
+    head = '<head><title>Bench</title><style>body{margin:0}</style><meta charset="utf-8"></head>'
+    scripts = ''.join(f'<script>var data{i} = "{"x" * 2000}";</script>' for i in range(script_blocks))
+    nav = '<nav>' + ''.join(f'<a href="/p{i}">Link {i}</a>' for i in range(50)) + '</nav>'
+    body = ''.join(f'<p>Paragraph {i} about coffee brewing, grind size and water temperature.</p>'
+                   for i in range(paragraphs))
+    nested = '<div>' * depth + 'deep text' + '</div>' * depth
+    return f'<html>{head}<body>{scripts}{nav}<article>{body}</article>{nested}</body></html>'
+
+
+def write_plain_pdf(path, paragraphs, pages):
+    """A long text-only PDF in a core font, standing in for a large uploaded document"""
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.set_font('Helvetica', size=11)
+    for page in range(pages):
+        pdf.add_page()
+        for paragraph in paragraphs:
+            text = paragraph.encode('latin-1', 'replace').decode('latin-1')
+            pdf.multi_cell(0, 5, f"{page}: {text}")
+    pdf.output(path)
+
+
+def import_app():
+    """Cold `import app` and `create_app()` in a fresh interpreter, as a gunicorn worker or `flask run` pays it"""
+    subprocess.run([sys.executable, '-c', 'import app; app.create_app()'], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def build_cases(quick=False):
+    """Return [(name, func, repeat)], importing the app lazily so --help stays fast"""
+    repeat = 3 if quick else 7
+    # A fresh interpreter each run, so interpreter start-up is included
+    cases = [('startup/import_app', import_app, repeat)]
+
+    import app
+    import html_extract
+    import pdf_render
+    import storage
+
+    # Subsystems are built per app, so the cases run inside one app's context
+    bench_app = app.create_app()
+    bench_app.app_context().push()
+
+    samples = load_saved_entries()
+
+    # extract_title
+    titles = [entry['sections'][0]['content'][0] if entry.get('sections') else entry['title'] for entry in samples]
+    cases.append(('extract_title/samples', lambda: [app.extract_title(t) for t in titles], repeat))
+    no_break = 'word ' * 20000
+    cases.append(('extract_title/100k_no_sentence_end', lambda: app.extract_title(no_break), repeat))
+    late_break = 'Title: ' + 'x' * 100000 + '. Rest'
+    cases.append(('extract_title/100k_late_sentence_end', lambda: app.extract_title(late_break), repeat))
+
+    # parse_html_content
+    sample_html = [entry['formatted_html'] for entry in samples if entry.get('formatted_html')]
+    cases.append(('parse_html_content/samples', lambda: [app.parse_html_content(h) for h in sample_html], repeat))
+    big_html = large_html(samples, 20 if quick else 50)
+    cases.append(('parse_html_content/large', lambda: app.parse_html_content(big_html), repeat))
+    unclosed = '<div class="space-y-6">' + '<p><strong>bold<i>italic' * 2000 + '</div>'
+    cases.append(('parse_html_content/unclosed_tags', lambda: app.parse_html_content(unclosed), repeat))
+
+    # create_styled_pdf
+    structure = app.parse_html_content(sample_html[0])
+    big_structure = app.parse_html_content(large_html(samples, 5))
+    unicode_structure = [
+        {'type': 'header', 'content': 'Привет мир — Ελληνικά — café'},
+        {'type': 'paragraph', 'content': '<b>Résumé</b> ' + 'Съешь же ещё этих мягких французских булок. ' * 40},
+    ] * 10
+    pdf_path = os.path.join(WORKDIR, 'bench.pdf')
+    cases.append(('create_styled_pdf/sample', lambda: pdf_render.create_styled_pdf(structure, pdf_path), repeat))
+    cases.append(('create_styled_pdf/large', lambda: pdf_render.create_styled_pdf(big_structure, pdf_path), repeat))
+    cases.append(('create_styled_pdf/unicode', lambda: pdf_render.create_styled_pdf(unicode_structure, pdf_path), repeat))
+
+    # extract_text_from_pdf
+    saved_pdfs = sorted(os.path.join(SAVED_SCRIPTS_DIR, name) for name in os.listdir(SAVED_SCRIPTS_DIR)
+                        if name.endswith('.pdf'))
+    cases.append(('extract_text_from_pdf/saved_scripts',
+                  lambda: [app.extract_text_from_pdf(path) for path in saved_pdfs], repeat))
+    long_pdf = os.path.join(WORKDIR, 'long.pdf')
+    write_plain_pdf(long_pdf, [entry.get('preview', '') or entry['title'] for entry in samples], pages=300)
+    cases.append(('extract_text_from_pdf/long_full', lambda: app.extract_text_from_pdf(long_pdf), repeat))
+    cases.append(('extract_text_from_pdf/long_budgeted',
+                  lambda: app.extract_text_from_pdf(long_pdf, max_chars=4000), repeat))
+    cases.append(('extract_text_from_pdf/long_sampled',
+                  lambda: app.extract_text_from_pdf(long_pdf, pages='sample'), repeat))
+    # PyPDF2 expands the full-range ToUnicode CMap of our embedded TTF fonts on every page
+    rendered_pdf = os.path.join(WORKDIR, 'rendered.pdf')
+    pdf_render.create_styled_pdf(structure, rendered_pdf)
+    cases.append(('extract_text_from_pdf/rendered_unicode', lambda: app.extract_text_from_pdf(rendered_pdf), repeat))
+
+    # extract_text_from_image; preprocessing runs without Tesseract, recognition only with it
+    from PIL import Image
+    image_path = os.path.join(EXAMPLES_DIR, 'coffee_image.jpg')
+    with Image.open(image_path) as img:
+        img.load()
+        large_image = img.resize((img.width * 4, img.height * 4))
+    cases.append(('ocr_prepare/coffee_image', lambda: app.ocr_engine.prepare(Image.open(image_path)), repeat))
+    cases.append(('ocr_prepare/upscaled_4x', lambda: app.ocr_engine.prepare(large_image), repeat))
+    cases.append(('ocr_cache_keys/coffee_image', lambda: app.ocr_cache.keys_for(Image.open(image_path)), repeat))
+    if app.ocr_engine.available:
+        # Tesseract itself on every call, as for an image nobody has uploaded before
+        cases.append(('ocr_recognize/coffee_image', lambda: app.ocr_engine.recognize(Image.open(image_path)), repeat))
+        # The first call fills the OCR cache, so this measures the cached path
+        cases.append(('extract_text_from_image/coffee_image_cached',
+                      lambda: app.extract_text_from_image(image_path), repeat))
+    else:
+        print("Tesseract not found, skipping the OCR recognition cases", file=sys.stderr)
+
+    # HTML-to-text step of the URL branch
+    small_page = web_page(50)
+    big_page = web_page(10000)
+    script_heavy = web_page(200, script_blocks=400)
+    deep_page = web_page(50, depth=500)
+    cases.append(('html_to_text/article_10kb', lambda: html_extract.html_to_text(small_page), repeat))
+    cases.append(('html_to_text/article_1mb', lambda: html_extract.html_to_text(big_page), repeat))
+    cases.append(('html_to_text/script_heavy', lambda: html_extract.html_to_text(script_heavy), repeat))
+    cases.append(('html_to_text/deeply_nested', lambda: html_extract.html_to_text(deep_page), repeat))
+    # What the URL branch actually asks for: one source's share of the context
+    cases.append(('html_to_text/article_1mb_budgeted',
+                  lambda: html_extract.html_to_text(big_page, max_chars=bench_app.config['CONTEXT_SOURCE_CHARS']), repeat))
+
+    # Metadata save/load at increasing library sizes
+    sizes = (10, 1000) if quick else (10, 1000, 100000)
+    for size in sizes:
+        db_path = os.path.join(WORKDIR, f'library_{size}.sqlite3')
+        store = storage.ScriptStore(db_path)
+        entries = synthetic_entries(samples, size)
+        store.add_many(entries)
+
+        extra = synthetic_entries(samples, size + 1)[-1]
+        middle = entries[size // 2]['filename']
+        cases.append((f'metadata/{size}/save_one', lambda store=store, extra=extra: store.add(extra), repeat))
+        cases.append((f'metadata/{size}/get', lambda store=store, name=middle: store.get(name), repeat))
+        cases.append((f'metadata/{size}/get_content', lambda store=store, name=middle: store.get_content(name), repeat))
+        cases.append((f'metadata/{size}/list_first_page', lambda store=store: store.list_page(24), repeat))
+        cases.append((f'metadata/{size}/search', lambda store=store: store.search('coffee tutorial'), repeat))
+        cases.append((f'metadata/{size}/open', lambda path=db_path: storage.ScriptStore(path), repeat))
+
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """
+    Return ({name: change}, regressions), where regressions lists (name, baseline_ms, current_ms, change)
+    for cases slower than the threshold allows. `results` is left as measured.
+    """
+    changes = {}
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        change = result['median_ms'] / previous['median_ms'] - 1 if previous['median_ms'] else 0.0
+        changes[name] = round(change, 3)
+        if change > threshold:
+            regressions.append((name, previous['median_ms'], result['median_ms'], change))
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='write these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='flag cases whose median is this fraction slower than baseline (default 0.25)')
+    parser.add_argument('--quick', action='store_true', help='fewer repeats and skip the 100k-entry library')
+    parser.add_argument('-k', dest='pattern', default='', help='only run cases whose name contains this text')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    args = parser.parse_args()
+
+    cases = [case for case in build_cases(args.quick) if args.pattern in case[0]]
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    print(f"{'case':<48} {'median ms':>11} {'min ms':>10} {'vs baseline':>12}")
+    for name, func, repeat in cases:
+        median_ms, min_ms = measure(func, repeat)
+        results[name] = {'median_ms': round(median_ms, 4), 'min_ms': round(min_ms, 4)}
+        previous = baseline.get('results', {}).get(name)
+        change = f"{median_ms / previous['median_ms'] - 1:+.1%}" if previous and previous['median_ms'] else '-'
+        print(f"{name:<48} {median_ms:>11.3f} {min_ms:>10.3f} {change:>12}", flush=True)
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': args.quick,
+        },
+        'results': results,
+    }
+    changes, regressions = compare(results, baseline, args.threshold)
+
+    if args.json_path:
+        # The comparison goes in its own section; a saved baseline holds only measurements
+        with open(args.json_path, 'w') as f:
+            json.dump({**report, 'changes': changes}, f, indent=2)
+    if args.save_baseline:
+        if args.pattern and os.path.exists(args.baseline):
+            # A filtered run only refreshes the cases it measured
+            with open(args.baseline, 'r') as f:
+                previous = json.load(f)
+            report['results'] = {**previous.get('results', {}), **results}
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for name, before, after, change in regressions:
+            print(f"  {name}: {before:.3f}ms -> {after:.3f}ms ({change:+.1%})")
+        return 1
+    if baseline:
+        print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
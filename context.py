@@ -0,0 +1,193 @@
+import logging
+import math
+import re
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Pieces a BPE tokenizer typically keeps apart: words, digit runs, single symbols
+TOKEN_PIECE_RE = re.compile(r'[^\W\d_]+|\d+|[^\w\s]', re.UNICODE)
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+PARAGRAPH_RE = re.compile(r'\n\s*\n')
+SENTENCE_RE = re.compile(r'(?<=[.!?。！？])\s+')
+
+STOPWORDS = frozenset('''
+    a an and are as at be but by for from has have how i in into is it its me my of on or our so
+    that the their them then there these this to was we were what when which who will with you your
+'''.split())
+
+
+def estimate_tokens(text):
+    """
+    Approximate the token count a BPE tokenizer would produce.
+
+    Common English words are one token and longer or rarer words split into
+    pieces of roughly four characters; numbers are grouped in threes and
+    punctuation costs a token each. Non-Latin text, which tokenizes far less
+    efficiently than its character count suggests, is charged per character.
+    """
+    return sum(piece_tokens(piece) for piece in TOKEN_PIECE_RE.findall(text))
+
+
+def piece_tokens(piece):
+    """Estimated tokens for one TOKEN_PIECE_RE match"""
+    if piece.isdigit():
+        return (len(piece) + 2) // 3
+    if piece.isascii():
+        return 1 if len(piece) <= 6 else math.ceil(len(piece) / 4)
+    return len(piece) if len(piece) < 4 else math.ceil(len(piece) / 1.5)
+
+
+def truncate_tokens(text, max_tokens):
+    """The longest prefix of `text` that estimate_tokens puts within `max_tokens`"""
+    tokens = 0
+    for match in TOKEN_PIECE_RE.finditer(text):
+        tokens += piece_tokens(match.group())
+        if tokens > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def terms(text):
+    """Lowercased index terms, without stopwords"""
+    return [term for term in TERM_RE.findall(text.lower()) if term not in STOPWORDS]
+
+
+def split_chunks(text, max_tokens=128):
+    """
+    Split text into chunks of at most about `max_tokens` tokens.
+
+    Paragraphs are kept whole where they fit, long paragraphs are split on
+    sentence boundaries, and runs of short paragraphs are merged so chunks
+    carry enough text to score.
+    """
+    pieces = []
+    for paragraph in PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in SENTENCE_RE.split(paragraph):
+            # Sentences with no break point (tables, minified text) are cut by words
+            words = sentence.split()
+            while words:
+                take, used = 0, 0
+                while take < len(words) and (take == 0 or used + estimate_tokens(words[take]) <= max_tokens):
+                    used += estimate_tokens(words[take])
+                    take += 1
+                pieces.append(' '.join(words[:take]))
+                words = words[take:]
+
+    chunks = []
+    current, current_tokens = [], 0
+    for piece in pieces:
+        piece_tokens = estimate_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append('\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def bm25_scores(query, documents, k1=1.5, b=0.75):
+    """Okapi BM25 score of each document (a list of terms) against the query terms"""
+    if not documents:
+        return []
+    average_length = sum(len(doc) for doc in documents) / len(documents) or 1
+    document_frequency = Counter()
+    for doc in documents:
+        document_frequency.update(set(doc))
+
+    query_terms = set(query)
+    idf = {
+        term: math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+        for term in query_terms if document_frequency[term]
+    }
+
+    scores = []
+    for doc in documents:
+        frequencies = Counter(doc)
+        norm = k1 * (1 - b + b * len(doc) / average_length)
+        scores.append(sum(
+            weight * frequencies[term] * (k1 + 1) / (frequencies[term] + norm)
+            for term, weight in idf.items() if frequencies[term]
+        ))
+    return scores
+
+
+def assemble_context(prompt, sources, token_budget, chunk_tokens=128):
+    """
+    Pack the source chunks most relevant to `prompt` into a token budget.
+
+    `sources` is a list of (header, text). Every chunk is scored against the
+    prompt with BM25 and the best are taken until the budget is spent; ties,
+    including prompts that match nothing, go to earlier chunks so each
+    source's opening is preferred. Chosen chunks are emitted in their
+    original order under their source header, with gaps marked by '...'.
+
+    Returns (context, stats).
+    """
+    chunks = []
+    for source_index, (header, text) in enumerate(sources):
+        for chunk_index, chunk in enumerate(split_chunks(text or '', chunk_tokens)):
+            chunks.append({
+                'source': source_index,
+                'index': chunk_index,
+                'text': chunk,
+                'tokens': estimate_tokens(chunk) + 1,
+            })
+
+    scores = bm25_scores(terms(prompt), [terms(chunk['text']) for chunk in chunks])
+    for chunk, score in zip(chunks, scores):
+        chunk['score'] = score
+
+    headers_used = set()
+    remaining = token_budget
+    # Source headers without any text (e.g. an unreachable URL) are still worth a mention
+    for source_index, (header, text) in enumerate(sources):
+        if not (text or '').strip() and estimate_tokens(header) <= remaining:
+            headers_used.add(source_index)
+            remaining -= estimate_tokens(header) + 1
+
+    selected = []
+    for chunk in sorted(chunks, key=lambda c: (-c['score'], c['index'], c['source'])):
+        cost = chunk['tokens']
+        if chunk['source'] not in headers_used:
+            cost += estimate_tokens(sources[chunk['source']][0]) + 1
+        if cost > remaining:
+            continue
+        remaining -= cost
+        headers_used.add(chunk['source'])
+        selected.append(chunk)
+
+    by_source = {}
+    for chunk in sorted(selected, key=lambda c: (c['source'], c['index'])):
+        by_source.setdefault(chunk['source'], []).append(chunk)
+
+    blocks = []
+    for source_index, (header, _) in enumerate(sources):
+        if source_index not in headers_used:
+            continue
+        lines = [header]
+        previous = -1
+        for chunk in by_source.get(source_index, []):
+            if chunk['index'] != previous + 1:
+                lines.append('...')
+            lines.append(chunk['text'])
+            previous = chunk['index']
+        blocks.append('\n'.join(lines))
+
+    stats = {
+        'chunks': len(chunks),
+        'chunks_used': len(selected),
+        'tokens_used': token_budget - remaining,
+        'token_budget': token_budget,
+    }
+    logger.info(f"Packed {stats['chunks_used']}/{stats['chunks']} context chunks "
+                f"into {stats['tokens_used']}/{token_budget} tokens")
+    return '\n\n'.join(blocks), stats
@@ -0,0 +1,164 @@
+import codecs
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from html_extract import TextExtractor
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+
+class UrlFetcher:
+    """
+    Fetches reference URLs and caches their extracted text.
+
+    Connections are pooled through one shared session, and bodies are
+    streamed through an incremental text extractor that stops reading once
+    `max_chars` of text are collected or `max_bytes` have arrived. Cached
+    pages are revalidated with conditional GETs (ETag / Last-Modified) once
+    older than `fresh_for` seconds.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024, max_chars=None, timeout=10, fresh_for=300, max_entries=512,
+                 pool_size=20):
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self.fresh_for = fresh_for
+        self.max_entries = max_entries
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = DEFAULT_USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'revalidated': 0, 'fetches': 0, 'truncated': 0}
+
+    def fetch_text(self, url, max_chars=None):
+        """
+        Return up to `max_chars` of the text of `url`, raising requests.RequestException on failure.
+
+        A cached page extracted with a smaller budget is fetched again in full.
+        """
+        max_chars = max_chars or self.max_chars
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry and not self._covers(entry, max_chars):
+                entry = None
+            if entry:
+                self._cache.move_to_end(url)
+                if time.time() - entry['fetched_at'] < self.fresh_for:
+                    self.stats['hits'] += 1
+                    return entry['text'][:max_chars]
+
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304 and entry:
+                with self._lock:
+                    entry['fetched_at'] = time.time()
+                    self.stats['revalidated'] += 1
+                logger.info(f"URL not modified, using cached text: {url}")
+                return entry['text'][:max_chars]
+
+            response.raise_for_status()
+            with stage('html_to_text'):
+                text, complete = self._extract(response, max_chars)
+
+            with self._lock:
+                self.stats['fetches'] += 1
+                self._cache[url] = {
+                    'text': text,
+                    'max_chars': max_chars,
+                    'complete': complete,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'fetched_at': time.time(),
+                }
+                self._cache.move_to_end(url)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+        return text
+
+    @staticmethod
+    def _covers(entry, max_chars):
+        """Whether a cached extraction holds all the text a `max_chars` request needs"""
+        if entry['complete'] or entry['max_chars'] is None:
+            return True
+        return max_chars is not None and entry['max_chars'] >= max_chars
+
+    def _extract(self, response, max_chars):
+        """
+        Stream the body through a TextExtractor, returning (text, complete).
+
+        Reading stops at `max_bytes` or as soon as the extractor has its
+        budget, so a long page costs only the bytes its text comes from.
+        `complete` is False when either limit cut the text short.
+        """
+        extractor = TextExtractor(max_chars)
+        decoder = None
+        head = b''
+        size = 0
+        byte_capped = False
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            chunk = chunk[:self.max_bytes - size]
+            size += len(chunk)
+            if decoder is None:
+                # The charset may only be declared in a <meta> tag near the top
+                head += chunk
+                if len(head) < 4096 and size < self.max_bytes:
+                    continue
+                decoder = codecs.getincrementaldecoder(self._encoding(response, head))(errors='replace')
+                chunk = head
+            extractor.feed(decoder.decode(chunk))
+            if extractor.done:
+                logger.info(f"Text budget filled after {size} bytes of {response.url}")
+                break
+            if size >= self.max_bytes:
+                with self._lock:
+                    self.stats['truncated'] += 1
+                logger.info(f"Stopped reading {response.url} at {size} bytes")
+                byte_capped = True
+                break
+        if not extractor.done:
+            # The body ended or hit max_bytes; either way flush the text still buffered
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(self._encoding(response, head))(errors='replace')
+                extractor.feed(decoder.decode(head))
+            extractor.feed(decoder.decode(b'', final=True))
+            extractor.close()
+        return extractor.text(), not (extractor.done or byte_capped)
+
+    def _encoding(self, response, head):
+        # requests assumes ISO-8859-1 for text/* without a charset, so prefer a <meta> declaration
+        if 'charset' in response.headers.get('Content-Type', '').lower():
+            encoding = response.encoding
+        else:
+            match = META_CHARSET_RE.search(head[:4096])
+            encoding = match.group(1).decode('ascii') if match else 'utf-8'
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            return 'utf-8'
+        return encoding
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'entries': len(self._cache)}
@@ -0,0 +1,256 @@
+import html
+from html.parser import HTMLParser
+
+# Elements whose text is never content
+SKIP_TAGS = {
+    'script', 'style', 'noscript', 'template', 'svg', 'canvas', 'iframe', 'object',
+    'nav', 'aside', 'footer', 'button', 'select',
+}
+MAIN_TAGS = {'main', 'article'}
+# No end tag, so they never open a level
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr',
+}
+# Main content shorter than this is probably a widget, not the page body
+MIN_MAIN_CHARS = 200
+
+
+class TextExtractor(HTMLParser):
+    """
+    Event-driven HTML-to-text extraction with a character budget.
+
+    Feed the document in pieces with `feed()`; text nodes are stripped and
+    joined by single spaces, skipping non-content elements. Text inside
+    <main> or <article> is collected separately and preferred when there
+    is enough of it. Both buffers stop at `max_chars`, and `done` turns
+    true once the main text is full, or once the page text is full and
+    another `max_chars` of text has gone by without a main element, so
+    callers can stop reading the document. Memory is bounded by the budget
+    plus whatever unparsed input `feed()` is holding.
+    """
+
+    def __init__(self, max_chars=None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.done = False
+        self._skip_depth = 0
+        self._main_depth = 0
+        self._seen_main = False
+        self._page = []
+        self._page_chars = 0
+        self._main = []
+        self._main_chars = 0
+        self._overflow_chars = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in MAIN_TAGS:
+            self._main_depth += 1
+            self._seen_main = True
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in MAIN_TAGS:
+            self._main_depth = max(0, self._main_depth - 1)
+
+    def handle_data(self, data):
+        if self._skip_depth or self.done:
+            return
+        text = data.strip()
+        if not text:
+            return
+
+        if self.max_chars is None:
+            self._page.append(text)
+            if self._main_depth:
+                self._main.append(text)
+            return
+
+        if self._page_chars < self.max_chars:
+            self._page_chars += self._append(self._page, text, self.max_chars - self._page_chars)
+        elif not self._seen_main:
+            self._overflow_chars += len(text)
+            if self._overflow_chars >= self.max_chars:
+                self.done = True
+        if self._main_depth:
+            self._main_chars += self._append(self._main, text, self.max_chars - self._main_chars)
+            if self._main_chars >= self.max_chars:
+                self.done = True
+
+    @staticmethod
+    def _append(parts, text, remaining):
+        """Add `text` (cut to `remaining`), returning the characters used, separator included"""
+        text = text[:remaining]
+        parts.append(text)
+        return len(text) + 1
+
+    def text(self):
+        """The main content if there is enough of it, otherwise the whole page's text"""
+        main = ' '.join(self._main)
+        if main and len(main) >= min(MIN_MAIN_CHARS, self.max_chars or MIN_MAIN_CHARS):
+            text = main
+        else:
+            text = ' '.join(self._page)
+        return text[:self.max_chars] if self.max_chars is not None else text
+
+
+def html_to_text(document, max_chars=None):
+    """Strip scripts, styles, navigation and markup from an HTML document"""
+    extractor = TextExtractor(max_chars)
+    # Fed in slices so an oversized page can stop as soon as the budget is met
+    for start in range(0, len(document), 64 * 1024):
+        extractor.feed(document[start:start + 64 * 1024])
+        if extractor.done:
+            break
+    else:
+        extractor.close()
+    return extractor.text()
+
+
+def serialize_start_tag(tag, attrs, self_closing=False):
+    """A start tag written the way BeautifulSoup prints one"""
+    parts = [tag]
+    for name, value in sorted(attrs):
+        value = html.escape(value or '', quote=False)
+        if '"' in value and "'" not in value:
+            parts.append(f"{name}='{value}'")
+        else:
+            parts.append(f'{name}="{value.replace(chr(34), "&quot;")}"')
+    return f"<{' '.join(parts)}{'/' if self_closing else ''}>"
+
+
+class ScriptHtmlParser(HTMLParser):
+    """
+    Single-pass parser for the script HTML the editor posts to /save_script.
+
+    Only the direct <h3> and <p> children of the first `div.space-y-6` are
+    kept: a header's text is that of its last <span>, and a paragraph keeps
+    <strong> and <i> children as <b>/<i> while other inline elements are
+    passed through as markup. Parsing stops when that div closes.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.content_structure = []
+        self.done = False
+        self._stack = []
+        self._root_depth = None
+        self._block = None       # 'h3' or 'p' currently being read
+        self._spans = []         # text of each <span> opened in the current <h3>
+        self._open_spans = []
+        self._block_text = []
+        self._inline = None      # 'b' or 'i' for a direct <strong>/<i> child of a <p>
+        self._inline_depth = None
+        self._markup_depth = None
+
+    def _depth(self):
+        return len(self._stack)
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        void = tag in VOID_TAGS
+        if self._root_depth is None:
+            classes = (dict(attrs).get('class') or '').split()
+            if tag == 'div' and 'space-y-6' in classes:
+                self._root_depth = self._depth() + 1
+            if not void:
+                self._stack.append(tag)
+            return
+
+        depth = self._depth() + 1
+        if self._block is None:
+            if depth == self._root_depth + 1 and tag in ('h3', 'p'):
+                self._block = tag
+                self._spans, self._open_spans, self._block_text = [], [], []
+        elif self._block == 'h3':
+            if tag == 'span' and not void:
+                self._spans.append([])
+                self._open_spans.append(len(self._spans) - 1)
+        elif self._markup_depth is not None:
+            self._block_text.append(serialize_start_tag(tag, attrs, self_closing=void))
+        elif self._inline is None and depth == self._root_depth + 2:
+            if tag in ('strong', 'i') and not void:
+                self._inline = 'b' if tag == 'strong' else 'i'
+                self._inline_depth = depth
+                self._block_text.append(f'<{self._inline}>')
+            else:
+                self._block_text.append(serialize_start_tag(tag, attrs, self_closing=void))
+                if not void:
+                    self._markup_depth = depth
+
+        if not void:
+            self._stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.done or tag not in self._stack:
+            return
+        # Like BeautifulSoup, an end tag closes everything opened inside it
+        while True:
+            depth = self._depth()
+            closing = self._stack.pop()
+            self._close(closing, depth)
+            if closing == tag or self.done:
+                return
+
+    def _close(self, tag, depth):
+        if self._root_depth is None:
+            return
+        if depth == self._root_depth:
+            self.done = True
+        elif self._block == 'h3':
+            if tag == 'span' and self._open_spans:
+                self._open_spans.pop()
+            if depth == self._root_depth + 1:
+                text = ''.join(self._spans[-1]) if self._spans else ''.join(self._block_text)
+                self.content_structure.append({'type': 'header', 'content': text.strip()})
+                self._block = None
+        elif self._block == 'p':
+            if self._markup_depth is not None:
+                self._block_text.append(f'</{tag}>')
+                if depth == self._markup_depth:
+                    self._markup_depth = None
+            elif self._inline is not None and depth == self._inline_depth:
+                self._block_text.append(f'</{self._inline}>')
+                self._inline = None
+            if depth == self._root_depth + 1:
+                self.content_structure.append({'type': 'paragraph', 'content': ''.join(self._block_text).strip()})
+                self._block = None
+
+    def handle_data(self, data):
+        if self.done or self._block is None:
+            return
+        if self._block == 'h3':
+            for index in self._open_spans:
+                self._spans[index].append(data)
+            self._block_text.append(data)
+        elif self._markup_depth is not None:
+            self._block_text.append(html.escape(data, quote=False))
+        else:
+            self._block_text.append(data)
+
+    def close(self):
+        super().close()
+        # Unclosed elements end with the document, as they do in BeautifulSoup
+        while self._stack and not self.done:
+            depth = self._depth()
+            self._close(self._stack.pop(), depth)
+
+
+def parse_script_html(formatted_html):
+    """[{'type': 'header' | 'paragraph', 'content': ...}] for a formatted script"""
+    parser = ScriptHtmlParser()
+    parser.feed(formatted_html)
+    if not parser.done:
+        parser.close()
+    return parser.content_structure
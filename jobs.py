@@ -0,0 +1,173 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = {SUCCEEDED, FAILED, CANCELLED}
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class Job:
+    """A single unit of background work and its outcome"""
+
+    def __init__(self, func, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.status == SUCCEEDED:
+            data['result'] = self.result
+        elif self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    """
+    Bounded worker pool that runs jobs off the request thread.
+
+    Finished jobs are kept for `result_ttl` seconds so clients can poll for
+    their results, then purged. Workers are started on first submit.
+    """
+
+    def __init__(self, workers=4, max_queued=100, result_ttl=900):
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue `func(job, *args, **kwargs)` and return its Job immediately"""
+        self._ensure_workers()
+        self._purge_expired()
+
+        job = Job(func, args, kwargs)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise QueueFullError("Job queue is full, try again later")
+
+        logger.info(f"Queued job {job.id} (depth {self._queue.qsize()})")
+        return job
+
+    def get(self, job_id):
+        self._purge_expired()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it already finished"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job.status in FINISHED_STATES:
+                return False
+            job._cancel_event.set()
+            # Queued jobs are skipped by the worker, running jobs check `job.cancelled`
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+        logger.info(f"Cancelled job {job_id}")
+        return True
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queued': self._queue.maxsize,
+                'running': self._running,
+                'workers': self.workers,
+                'jobs': counts,
+            }
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                with self._lock:
+                    if job.cancelled:
+                        continue
+                    job.status = RUNNING
+                    job.started_at = time.time()
+                    self._running += 1
+
+                try:
+                    result = job.func(job, *job.args, **job.kwargs)
+                    status, error = SUCCEEDED, None
+                except Exception as e:
+                    logger.error(f"Job {job.id} failed: {str(e)}", exc_info=True)
+                    result, status, error = None, FAILED, str(e)
+
+                with self._lock:
+                    self._running -= 1
+                    job.finished_at = time.time()
+                    if job.cancelled:
+                        job.status = CANCELLED
+                    else:
+                        job.status = status
+                        job.result = result
+                        job.error = error
+                    # Drop references to the inputs (uploads can be large)
+                    job.args, job.kwargs = (), {}
+
+                logger.info(f"Job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s")
+            finally:
+                self._queue.task_done()
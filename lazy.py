@@ -0,0 +1,57 @@
+import threading
+
+from flask import current_app, has_app_context
+
+# Key in `app.extensions` holding each app's built subsystems
+EXTENSION_KEY = 'subsystems'
+
+
+class Lazy:
+    """
+    Stand-in for a subsystem that is built on first use, once per app.
+
+    Attribute access is forwarded to the object `build()` returns for the
+    current Flask app, so module-level names keep working while the imports
+    and setup behind them (OCR, PDF rendering, HTML parsing, the LLM client)
+    are paid for only by the first request that needs them. Instances live
+    in the app's `extensions`, so every app made by `create_app()` builds
+    its own from its own `current_app.config`. Building happens under a
+    lock, so concurrent first requests share one instance.
+
+    Use needs an app context; work handed to other threads should carry it
+    (see `metrics.submit_traced`). The proxy's own names are private (plus
+    `loaded`) so they never shadow the wrapped object's, e.g. a store's `get()`.
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._name = build.__name__
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        instances = current_app.extensions.setdefault(EXTENSION_KEY, {})
+        instance = instances.get(self._name)
+        if instance is None:
+            with self._lock:
+                instance = instances.get(self._name)
+                if instance is None:
+                    instance = instances[self._name] = self._build()
+        return instance
+
+    @property
+    def loaded(self):
+        """True once the current app has built it (False outside an app context)"""
+        return has_app_context() and self._name in current_app.extensions.get(EXTENSION_KEY, {})
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __repr__(self):
+        if not self.loaded:
+            return f'<Lazy {self._name}: not loaded>'
+        return f'<Lazy {self._name}: {current_app.extensions[EXTENSION_KEY][self._name]!r}>'
+
+
+def lazy(build):
+    """Decorator turning a builder function into a module-level Lazy of the same name"""
+    return Lazy(build)
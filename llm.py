@@ -0,0 +1,286 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from scheduler import is_rate_limited, retry_after
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERROR_NAMES = {'APITimeoutError', 'APIConnectionError', 'InternalServerError'}
+
+# A finished completion and the model that actually wrote it (the fallback's, after a fallback or hedge win)
+Completion = namedtuple('Completion', ['text', 'model'])
+
+
+def is_timeout(error):
+    return isinstance(error, TimeoutError) or type(error).__name__ == 'APITimeoutError'
+
+
+def is_retryable(error):
+    """Timeouts, dropped connections, 429s and 5xx responses are worth another attempt"""
+    if is_rate_limited(error) or is_timeout(error) or isinstance(error, ConnectionError):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    return (getattr(error, 'status_code', None) or 0) >= 500
+
+
+class GroqProvider:
+    """Chat completions from Groq; the client is created on first use"""
+
+    name = 'groq'
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from groq import Groq
+                # Retries are handled by LlmClient, so the SDK's own are turned off
+                self._client = Groq(api_key=self.api_key, max_retries=0)
+            return self._client
+
+    @staticmethod
+    def _options(max_tokens=None, timeout=None):
+        # The SDK reads an explicit None as "no limit", so unset options are left out
+        options = {}
+        if max_tokens is not None:
+            options['max_tokens'] = max_tokens
+        if timeout is not None:
+            options['timeout'] = timeout
+        return options
+
+    def complete(self, messages, model, temperature, max_tokens=None, timeout=None):
+        completion = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            **self._options(max_tokens, timeout),
+        )
+        return completion.choices[0].message.content
+
+    def stream(self, messages, model, temperature, timeout=None):
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **self._options(timeout=timeout),
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+
+class StubProvider:
+    """
+    Offline provider that returns a canned script after a configurable delay.
+
+    `latency` is the time to the first token and `token_delay` the gap
+    between streamed words, so the rest of the app can be exercised and
+    load-tested without network access or an API key.
+    """
+
+    name = 'stub'
+
+    def __init__(self, latency=0.5, token_delay=0.02):
+        self.latency = latency
+        self.token_delay = token_delay
+
+    def _script(self, messages):
+        prompt = messages[-1]['content']
+        if isinstance(prompt, list):
+            prompt = ' '.join(part.get('text', '') for part in prompt if isinstance(part, dict))
+        topic = re.sub(r'\s+', ' ', prompt.split('\n\n')[0]).strip()[:80] or 'Untitled'
+        return (
+            f"# {topic}\n\n"
+            f"## Opening Hook\n"
+            f"**[Visual: Fast cuts introducing {topic}]**\n\n"
+            f"Narrator: Ever wondered what makes {topic} worth your time? Let's find out.\n\n"
+            f"## Main Content\n"
+            f"**[Visual: Presenter on camera with supporting b-roll]**\n\n"
+            f"Narrator: Here are the three things you need to know about {topic}.\n\n"
+            f"## Call to Action\n"
+            f"**[Visual: Subscribe button animation]**\n\n"
+            f"Narrator: If this helped, like and subscribe for more.\n"
+        )
+
+    def _wait(self, seconds, timeout):
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Stub provider timed out after {timeout}s")
+        time.sleep(seconds)
+
+    def complete(self, messages, model, temperature, max_tokens=None, timeout=None):
+        script = self._script(messages)
+        self._wait(self.latency + self.token_delay * len(script.split()), timeout)
+        return script
+
+    def stream(self, messages, model, temperature, timeout=None):
+        self._wait(self.latency, timeout)
+        for i, word in enumerate(re.findall(r'\S+\s*', self._script(messages))):
+            if i:
+                time.sleep(self.token_delay)
+            yield word
+
+
+class CompletionStream:
+    """
+    Iterator over a streamed completion's deltas.
+
+    `model` is the model producing them, known once the first delta has
+    arrived; a stream that fell back before its first token reports the
+    fallback model.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.model = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.model, delta = next(self._chunks)
+        return delta
+
+    def close(self):
+        self._chunks.close()
+
+
+class LlmClient:
+    """
+    Resilient front end for a chat completion provider.
+
+    Every call has a timeout. Retryable failures (timeouts, connection
+    errors, 429s, 5xx) are retried with full-jitter exponential backoff,
+    and a timeout or rate limit on the primary model moves later attempts
+    to `fallback_model`. With `hedge_after` set, a completion that has not
+    returned by then is raced against a second request (on the fallback
+    model when there is one) and the first good answer wins. Streams retry
+    and fall back only until their first token arrives.
+
+    Callers that pace themselves against the provider quota (the batch
+    scheduler, the long-document summarizer) pass `retry_rate_limits=False`:
+    a 429 is then raised to them straight away and the call is not hedged,
+    so their backoff sees every rate limit and no call is made that they
+    did not budget for.
+    """
+
+    def __init__(self, provider, model, fallback_model=None, timeout=60, max_retries=2, backoff=0.5,
+                 hedge_after=None):
+        self.provider = provider
+        self.model = model
+        self.fallback_model = fallback_model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hedge')
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'retries': 0, 'fallbacks': 0, 'hedges': 0, 'hedge_wins': 0, 'failures': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _next_model(self, model, error, attempt):
+        """Model for the next attempt, and how long to wait before it"""
+        if self.fallback_model and model != self.fallback_model and (is_rate_limited(error) or is_timeout(error)):
+            self._count('fallbacks')
+            logger.warning(f"{model} unavailable ({type(error).__name__}), falling back to {self.fallback_model}")
+            return self.fallback_model, 0.0
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        if is_rate_limited(error):
+            delay = max(delay, retry_after(error, 0.0))
+        return model, delay
+
+    def complete(self, messages, temperature, max_tokens=None, retry_rate_limits=True):
+        """Return a Completion, raising the last error once retries are exhausted"""
+        self._count('calls')
+        model = self.model
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._complete_hedged(messages, model, temperature, max_tokens, hedge=retry_rate_limits)
+            except Exception as e:
+                if (not is_retryable(e) or attempt == self.max_retries
+                        or (is_rate_limited(e) and not retry_rate_limits)):
+                    self._count('failures')
+                    raise
+                model, delay = self._next_model(model, e, attempt)
+                self._count('retries')
+                logger.warning(f"LLM call failed ({str(e)}), retrying on {model} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _complete_once(self, messages, model, temperature, max_tokens):
+        return Completion(
+            self.provider.complete(messages, model, temperature, max_tokens=max_tokens, timeout=self.timeout),
+            model)
+
+    def _complete_hedged(self, messages, model, temperature, max_tokens, hedge=True):
+        if not hedge or not self.hedge_after:
+            return self._complete_once(messages, model, temperature, max_tokens)
+
+        primary = self._hedge_pool.submit(self._complete_once, messages, model, temperature, max_tokens)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        self._count('hedges')
+        hedge_model = self.fallback_model or model
+        logger.info(f"No response from {model} after {self.hedge_after}s, hedging on {hedge_model}")
+        hedge = self._hedge_pool.submit(self._complete_once, messages, hedge_model, temperature, max_tokens)
+
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count('hedge_wins')
+                    # The loser keeps running in the pool; its result is simply dropped
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def stream(self, messages, temperature):
+        """A CompletionStream of content deltas"""
+        return CompletionStream(self._stream(messages, temperature))
+
+    def _stream(self, messages, temperature):
+        """Yield (model, delta) pairs"""
+        self._count('calls')
+        model = self.model
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                for delta in self.provider.stream(messages, model, temperature, timeout=self.timeout):
+                    started = True
+                    yield model, delta
+                return
+            except Exception as e:
+                # Once text has reached the caller, a retry would duplicate it
+                if started or not is_retryable(e) or attempt == self.max_retries:
+                    self._count('failures')
+                    raise
+                model, delay = self._next_model(model, e, attempt)
+                self._count('retries')
+                logger.warning(f"LLM stream failed ({str(e)}), retrying on {model} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'provider': self.provider.name, 'model': self.model,
+                    'fallback_model': self.fallback_model}
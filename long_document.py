@@ -0,0 +1,161 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from context import estimate_tokens, split_chunks
+from metrics import submit_traced
+from response_cache import make_cache_key
+from scheduler import is_rate_limited, retry_after
+
+logger = logging.getLogger(__name__)
+
+MAP_SYSTEM_PROMPT = (
+    "You condense reference material for a video script writer. Summarize the excerpt in a few "
+    "sentences, keeping concrete facts, names, figures, dates and memorable quotes. "
+    "Do not add anything that is not in the excerpt."
+)
+REDUCE_SYSTEM_PROMPT = (
+    "You condense reference material for a video script writer. The text is a run of consecutive "
+    "summaries of one long document. Merge them into one shorter summary, keeping concrete facts, "
+    "names, figures, dates and memorable quotes. Do not add anything that is not in the text."
+)
+
+
+class DocumentSummarizer:
+    """
+    Map-reduce summarisation for reference documents too long to send whole.
+
+    The map phase splits a document into chunks and summarises them in
+    parallel on a shared pool of `workers` threads, which bounds concurrent
+    model calls across all requests. A rate-limit response pauses every
+    worker until the provider's Retry-After has passed, then retries.
+    Chunk summaries are cached by content, independent of the prompt, so a
+    later request on the same document skips the map phase.
+
+    Given a token budget, the reduce phase summarises the joined summaries
+    again, in chunk-sized groups, until they fit (or stop shrinking), so the
+    whole document is represented in what reaches generation.
+
+    `complete(messages, max_tokens)` performs one model call and returns
+    (text, model that answered); only `model`'s own summaries are cached, so
+    a fallback model's output is never reused as if the primary wrote it.
+    """
+
+    def __init__(self, complete, cache, model, workers=4, chunk_tokens=1500, summary_tokens=200,
+                 temperature=0.2, max_retries=3, max_reduce_rounds=3):
+        self.complete = complete
+        self.cache = cache
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.summary_tokens = summary_tokens
+        self.temperature = temperature
+        self.max_retries = max_retries
+        self.max_reduce_rounds = max_reduce_rounds
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='summarize')
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.stats = {'chunks': 0, 'cache_hits': 0, 'rate_limited': 0, 'failures': 0}
+
+    def needs_summary(self, text):
+        """Only documents longer than one chunk are worth a map phase"""
+        return estimate_tokens(text) > self.chunk_tokens
+
+    def summarize(self, text, max_tokens=None):
+        """
+        Summarise `text` chunk by chunk, then reduce the result to about `max_tokens`.
+
+        Returns (summary, timings); chunks whose summary fails are left out
+        rather than failing the whole document.
+        """
+        started = time.perf_counter()
+        chunks = split_chunks(text, self.chunk_tokens)
+        split_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        results = self._summarize_all(chunks, MAP_SYSTEM_PROMPT)
+        map_ms = (time.perf_counter() - started) * 1000
+
+        summary = '\n\n'.join(summary for summary, _ in results if summary)
+        cached = sum(1 for _, hit in results if hit)
+        timings = {
+            'split_ms': round(split_ms, 1),
+            'map_ms': round(map_ms, 1),
+            'chunks': len(chunks),
+            'cached_chunks': cached,
+        }
+        logger.info(f"Summarised {len(chunks)} chunks ({cached} cached) in {timings['map_ms']}ms")
+
+        if max_tokens and summary:
+            started = time.perf_counter()
+            summary, timings['reduce_rounds'] = self._reduce(summary, max_tokens)
+            timings['reduce_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return summary, timings
+
+    def _summarize_all(self, chunks, system_prompt):
+        # Chunks run in the caller's context, so the app's model client and the request trace carry over
+        futures = [submit_traced(self._pool, self._summarize_chunk, chunk, system_prompt) for chunk in chunks]
+        return [future.result() for future in futures]
+
+    def _reduce(self, summary, max_tokens):
+        """Summarise the summaries until they fit `max_tokens`; returns (summary, rounds run)"""
+        rounds = 0
+        while estimate_tokens(summary) > max_tokens and rounds < self.max_reduce_rounds:
+            results = self._summarize_all(split_chunks(summary, self.chunk_tokens), REDUCE_SYSTEM_PROMPT)
+            reduced = '\n\n'.join(text for text, _ in results if text)
+            rounds += 1
+            if not reduced or estimate_tokens(reduced) >= estimate_tokens(summary):
+                break
+            summary = reduced
+        logger.info(f"Reduced summary to ~{estimate_tokens(summary)} tokens in {rounds} round(s)")
+        return summary, rounds
+
+    def _summarize_chunk(self, chunk, system_prompt=MAP_SYSTEM_PROMPT):
+        """Summary of one chunk and whether it came from the cache"""
+        key = make_cache_key(self.model, self.temperature, system_prompt, chunk)
+        cached = self.cache.get(key)
+        with self._lock:
+            self.stats['chunks'] += 1
+            if cached is not None:
+                self.stats['cache_hits'] += 1
+        if cached is not None:
+            return cached, True
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": chunk},
+        ]
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_rate_limit()
+            try:
+                summary, answered_by = self.complete(messages, self.summary_tokens)
+                break
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    logger.error(f"Chunk summary failed: {str(e)}")
+                    with self._lock:
+                        self.stats['failures'] += 1
+                    return None, False
+                # Back off every worker, not just this one, since they share the quota
+                delay = retry_after(e, 2 ** attempt) + random.uniform(0, 0.5)
+                with self._lock:
+                    self.stats['rate_limited'] += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(f"Rate limited while summarising, pausing {delay:.1f}s")
+
+        if summary and answered_by == self.model:
+            self.cache.set(key, summary)
+        return summary, False
+
+    def _wait_for_rate_limit(self):
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
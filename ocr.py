@@ -0,0 +1,348 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pytesseract
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREPROCESS = ('downscale', 'grayscale', 'deskew')
+
+
+class OcrEngine:
+    """
+    Tesseract OCR over in-memory Pillow images.
+
+    Tesseract is probed once and the result reused. Images pass through a
+    configurable preprocessing pipeline before recognition; available steps
+    are 'downscale', 'grayscale', 'binarize' and 'deskew', applied in order.
+    """
+
+    def __init__(self, preprocess=DEFAULT_PREPROCESS, max_dimension=2000, min_dimension=50,
+                 deskew_range=5, deskew_step=0.5):
+        unknown = [step for step in preprocess if step not in self.STEPS]
+        if unknown:
+            raise ValueError(f"Unknown OCR preprocessing steps: {', '.join(unknown)}")
+        self.preprocess = tuple(preprocess)
+        self.max_dimension = max_dimension
+        self.min_dimension = min_dimension
+        self.deskew_range = deskew_range
+        self.deskew_step = deskew_step
+        self.version = None
+        self._probed = False
+        self._lock = threading.Lock()
+
+    def probe(self):
+        """Check for Tesseract once; later calls return the cached answer"""
+        with self._lock:
+            if not self._probed:
+                try:
+                    self.version = str(pytesseract.get_tesseract_version())
+                    logger.info(f"Tesseract OCR version: {self.version}")
+                except Exception as e:
+                    logger.error(f"Tesseract OCR not properly installed: {str(e)}")
+                    self.version = None
+                self._probed = True
+            return self.version is not None
+
+    @property
+    def available(self):
+        return self.probe()
+
+    @property
+    def signature(self):
+        """Identifies the engine configuration, so cached results from another setup aren't reused"""
+        self.probe()
+        return f"{self.version}|{','.join(self.preprocess)}|{self.max_dimension}"
+
+    def validate(self, img):
+        """Check that an image is suitable for OCR, returning (is_valid, message)"""
+        width, height = img.size
+        if width < self.min_dimension or height < self.min_dimension:
+            logger.warning(f"Image too small: {width}x{height}")
+            return False, "Image too small for OCR"
+        return True, "Image valid for OCR"
+
+    def prepare(self, img):
+        """Run the preprocessing pipeline and return the image to recognise"""
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('L', 'RGB'):
+            img = img.convert('RGB')
+        for step in self.preprocess:
+            img = self.STEPS[step](self, img)
+        return img
+
+    def recognize(self, img):
+        """Preprocess an image and return the recognised text"""
+        return pytesseract.image_to_string(self.prepare(img))
+
+    def _downscale(self, img):
+        # Phone photos are far larger than Tesseract needs for body text
+        longest = max(img.size)
+        if longest <= self.max_dimension:
+            return img
+        scale = self.max_dimension / longest
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        logger.debug(f"Downscaling image from {img.size} to {size}")
+        return img.resize(size, Image.LANCZOS)
+
+    def _grayscale(self, img):
+        return img if img.mode == 'L' else img.convert('L')
+
+    def _binarize(self, img):
+        gray = self._grayscale(img)
+        threshold = otsu_threshold(gray.histogram())
+        return gray.point(lambda p: 255 if p > threshold else 0)
+
+    def _deskew(self, img):
+        angle = estimate_skew(self._grayscale(img), self.deskew_range, self.deskew_step)
+        if abs(angle) < self.deskew_step:
+            return img
+        logger.debug(f"Deskewing image by {angle} degrees")
+        fill = 255 if img.mode == 'L' else (255, 255, 255)
+        return img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+
+    STEPS = {
+        'downscale': _downscale,
+        'grayscale': _grayscale,
+        'binarize': _binarize,
+        'deskew': _deskew,
+    }
+
+
+def otsu_threshold(histogram):
+    """Otsu's threshold for a 256-bin grayscale histogram"""
+    total = sum(histogram)
+    if not total:
+        return 127
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = 0
+    weight_background = 0
+    best_threshold, best_variance = 127, -1.0
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if not weight_background:
+            continue
+        weight_foreground = total - weight_background
+        if not weight_foreground:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = i, variance
+    return best_threshold
+
+
+def estimate_skew(gray, max_angle=5, step=0.5, sample_size=600):
+    """
+    Estimate text skew in degrees with a projection profile.
+
+    Text lines produce the sharpest horizontal row-sum profile when level, so
+    the rotation that maximises row-sum variance on a small inverted copy of
+    the image is taken as the correction angle.
+    """
+    scale = sample_size / max(gray.size)
+    if scale < 1:
+        gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))))
+    inverted = ImageOps.invert(gray)
+
+    best_angle, best_score = 0.0, -1.0
+    steps = int(max_angle / step)
+    for i in range(-steps, steps + 1):
+        angle = i * step
+        rotated = inverted.rotate(angle, resample=Image.BILINEAR, expand=False)
+        # Resizing to a single column averages each row in C rather than Python
+        rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+        mean = sum(rows) / len(rows)
+        score = sum((r - mean) ** 2 for r in rows)
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def pixel_hash(img):
+    """SHA-256 over the decoded pixels, so identical images match regardless of file encoding"""
+    digest = hashlib.sha256(f'{img.mode}:{img.size[0]}x{img.size[1]}:'.encode('ascii'))
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def difference_hash(img, size=8):
+    """64-bit dHash; re-encoded or resized copies of an image land within a few bits"""
+    small = img.convert('L').resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+# Near matches are confirmed on a grayscale thumbnail before their text is served
+THUMB_SIZE = 64
+MAX_ASPECT_DRIFT = 0.01   # relative difference in width/height
+MAX_MEAN_PIXEL_DIFF = 3   # average over the thumbnail, 0-255
+MAX_PIXEL_DIFF = 20       # any single thumbnail pixel; a changed word moves a few by more
+
+
+def thumbnail(img):
+    """THUMB_SIZE x THUMB_SIZE contrast-normalised grayscale pixels, as bytes"""
+    small = ImageOps.autocontrast(img.convert('L')).resize((THUMB_SIZE, THUMB_SIZE), Image.BOX)
+    return small.tobytes()
+
+
+def same_thumbnail(a, b):
+    if not a or not b or len(a) != len(b):
+        return False
+    diffs = [abs(x - y) for x, y in zip(a, b)]
+    return max(diffs) <= MAX_PIXEL_DIFF and sum(diffs) / len(diffs) <= MAX_MEAN_PIXEL_DIFF
+
+
+class OcrCache:
+    """
+    Persistent store of OCR results keyed by image content.
+
+    Lookups use the exact pixel hash, read from SQLite so entries written by
+    other processes sharing the file are served too. With `max_distance`
+    set, an image that misses also tries stored images whose perceptual hash
+    is within that
+    many bits; a 64-bit dHash alone cannot tell apart two text pages with
+    the same layout, so each candidate must also have the same aspect ratio
+    and a near-identical thumbnail before its text is served. Perceptual
+    matching is off by default. Entries are scoped to an engine signature
+    (Tesseract version and preprocessing), kept in SQLite so they survive
+    restarts, and evicted least-recently-used beyond `max_entries`.
+    """
+
+    def __init__(self, db_path, signature='', max_entries=5000, max_distance=0):
+        self.db_path = db_path
+        self.signature = signature
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.stats = {'exact_hits': 0, 'perceptual_hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS ocr_results (
+                content_hash TEXT PRIMARY KEY,
+                dhash TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_ocr_last_used ON ocr_results (last_used);
+        ''')
+        # Rows cached before thumbnails were kept are never served as near matches
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(ocr_results)')]
+        if 'aspect' not in columns:
+            self._conn.execute('ALTER TABLE ocr_results ADD COLUMN aspect REAL')
+            self._conn.execute('ALTER TABLE ocr_results ADD COLUMN thumb BLOB')
+            self._conn.commit()
+        # Perceptual hashes are compared in Python, so keep them in memory, catching up on
+        # rows other processes add (by rowid) before each near-match scan
+        self._dhashes = {}
+        self._synced_rowid = 0
+        self._sync_dhashes()
+
+    def keys_for(self, img):
+        """(pixel hash, dHash, aspect ratio, thumbnail) for get() and set(); no thumbnail while near matching is off"""
+        return (pixel_hash(img), difference_hash(img), img.width / img.height,
+                thumbnail(img) if self.max_distance else None)
+
+    def get(self, keys):
+        content_hash, dhash, aspect, thumb = keys
+        with self._lock:
+            text = self._text_for(content_hash)
+            if text is not None:
+                self.stats['exact_hits'] += 1
+                return text
+            if self.max_distance:
+                self._sync_dhashes()
+                match = self._nearest(dhash, aspect, thumb)
+                text = self._text_for(match) if match else None
+                if text is not None:
+                    self.stats['perceptual_hits'] += 1
+                    return text
+            self.stats['misses'] += 1
+            return None
+
+    def _text_for(self, content_hash):
+        """Stored text for a pixel hash under this signature, marking it used (lock held)"""
+        row = self._conn.execute('SELECT text FROM ocr_results WHERE content_hash = ? AND signature = ?',
+                                 (content_hash, self.signature)).fetchone()
+        if row is None:
+            self._dhashes.pop(content_hash, None)
+            return None
+        self._conn.execute('UPDATE ocr_results SET last_used = ? WHERE content_hash = ?', (time.time(), content_hash))
+        self._conn.commit()
+        return row[0]
+
+    def _sync_dhashes(self):
+        """Load perceptual hashes of rows added since the last sync, by any process (lock held, or in __init__)"""
+        for rowid, content_hash, dhash in self._conn.execute(
+                'SELECT rowid, content_hash, dhash FROM ocr_results WHERE signature = ? AND rowid > ? ORDER BY rowid',
+                (self.signature, self._synced_rowid)):
+            self._dhashes[content_hash] = int(dhash, 16)
+            self._synced_rowid = rowid
+
+    def set(self, keys, text):
+        content_hash, dhash, aspect, thumb = keys
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ocr_results '
+                '(content_hash, dhash, signature, text, created_at, last_used, aspect, thumb) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (content_hash, f'{dhash:016x}', self.signature, text, now, now, aspect, thumb))
+            self._dhashes[content_hash] = dhash
+            self._evict()
+            self._conn.commit()
+
+    def _nearest(self, dhash, aspect, thumb):
+        """Closest confirmed near match within `max_distance` bits (lock held)"""
+        candidates = []
+        for content_hash, candidate in self._dhashes.items():
+            distance = bin(dhash ^ candidate).count('1')
+            if distance <= self.max_distance:
+                candidates.append((distance, content_hash))
+        for _, content_hash in sorted(candidates):
+            row = self._conn.execute('SELECT aspect, thumb FROM ocr_results WHERE content_hash = ?',
+                                     (content_hash,)).fetchone()
+            if (row and row[0] and abs(row[0] - aspect) <= MAX_ASPECT_DRIFT * aspect
+                    and same_thumbnail(row[1], thumb)):
+                return content_hash
+        return None
+
+    def _evict(self):
+        """Drop least recently used rows beyond `max_entries` (lock held)"""
+        count = self._conn.execute('SELECT COUNT(*) FROM ocr_results').fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        evicted = [row[0] for row in self._conn.execute(
+            'SELECT content_hash FROM ocr_results ORDER BY last_used LIMIT ?', (excess,))]
+        self._conn.executemany('DELETE FROM ocr_results WHERE content_hash = ?', [(h,) for h in evicted])
+        for content_hash in evicted:
+            self._dhashes.pop(content_hash, None)
+        self.stats['evictions'] += len(evicted)
+
+    def get_stats(self):
+        with self._lock:
+            hits = self.stats['exact_hits'] + self.stats['perceptual_hits']
+            lookups = hits + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'entries': self._conn.execute('SELECT COUNT(*) FROM ocr_results WHERE signature = ?',
+                                              (self.signature,)).fetchone()[0],
+            }
@@ -0,0 +1,546 @@
+import hashlib
+import html
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import re
+import threading
+import time
+import unicodedata
+import warnings
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
+
+import metrics
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:
+    arabic_reshaper = None
+    get_display = None
+
+logger = logging.getLogger(__name__)
+
+# fpdf 1.7.2 writes a subset cmap it cannot encode for high code points (Arabic presentation forms);
+# glyphs are drawn through the CID map, so the warning is noise
+warnings.filterwarnings('ignore', message='cmap value too big/small', module='fpdf.ttfonts')
+
+READY = 'ready'
+PENDING = 'pending'
+FAILED = 'failed'
+MISSING = 'missing'
+
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'fonts')
+
+# Roboto has no bold-italic cut, so bold stands in for it
+PRIMARY_FONT_FILES = {
+    '': 'Roboto-Regular.ttf',
+    'B': 'Roboto-Bold.ttf',
+    'I': 'Roboto-Italic.ttf',
+    'BI': 'Roboto-Bold.ttf',
+}
+
+# Fonts tried, in order, for characters Roboto has no glyph for (Devanagari, Arabic, ...).
+# Noto Serif Devanagari and Noto Naskh Arabic ship in static/fonts; the rest are used when installed
+FALLBACK_FONT_FILES = [
+    'NotoSansDevanagari-Regular.ttf',
+    'NotoSerifDevanagari-Regular.ttf',
+    'NotoSans-Regular.ttf',
+    'NotoNaskhArabic-Regular.ttf',
+    'NotoSansArabic-Regular.ttf',
+    'Mangal.ttf',
+    'Nirmala.ttf',
+]
+FALLBACK_FONT_DIRS = [FONT_DIR, '/usr/share/fonts', '/usr/local/share/fonts', 'C:\\Windows\\Fonts']
+
+# fpdf's character width for a glyph that exists but has no advance
+ZERO_WIDTH = 65535
+
+# Bidi classes (whitespace, separators, other neutrals) that take the direction of the text around them
+RTL_NEUTRAL_CLASSES = {'WS', 'CS', 'ES', 'ET', 'ON', 'S'}
+
+ARABIC_RANGES = ((0x0600, 0x06FF), (0x0750, 0x077F), (0x08A0, 0x08FF), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF))
+
+INLINE_RE = re.compile(r'<(b|i)>(.*?)</\1>|<[^>]*>|[^<]+', re.DOTALL)
+TAG_RE = re.compile(r'<[^>]*>')
+BREAK_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+SPACE_RE = re.compile(r'[ \t\r\f\v]+')
+
+# Font metrics parsed once per process, keyed by TTF path
+_font_metrics = {}
+_font_metrics_lock = threading.Lock()
+_default_engine = None
+
+
+def load_font_metrics(ttf_path):
+    """
+    Metrics for a TTF font, parsed at most once per process.
+
+    fpdf's pickled metric cache next to the font is reused when it matches
+    the font file. The shipped .pkl files were generated on Windows, so the
+    embedded font path is always replaced with the real one.
+    """
+    ttf_path = os.path.abspath(ttf_path)
+    with _font_metrics_lock:
+        font_metrics = _font_metrics.get(ttf_path)
+        if font_metrics is not None:
+            return font_metrics
+
+        size = os.path.getsize(ttf_path)
+        pkl_path = os.path.splitext(ttf_path)[0] + '.pkl'
+        font_metrics = None
+        if os.path.exists(pkl_path):
+            try:
+                with open(pkl_path, 'rb') as f:
+                    font_metrics = pickle.load(f)
+                if font_metrics.get('originalsize') != size:
+                    font_metrics = None
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable font metrics {pkl_path}: {str(e)}")
+                font_metrics = None
+
+        if font_metrics is None:
+            with open(ttf_path, 'rb') as f:
+                # TrueType (1.0) or OpenType-with-TrueType-outlines signatures
+                if f.read(4) not in (b'\x00\x01\x00\x00', b'true'):
+                    raise ValueError(f"Not a TrueType font: {ttf_path}")
+            ttf = TTFontFile()
+            ttf.getMetrics(ttf_path)
+            font_metrics = {
+                'name': re.sub('[ ()]', '', ttf.fullName),
+                'type': 'TTF',
+                'desc': {
+                    'Ascent': int(round(ttf.ascent, 0)),
+                    'Descent': int(round(ttf.descent, 0)),
+                    'CapHeight': int(round(ttf.capHeight, 0)),
+                    'Flags': ttf.flags,
+                    'FontBBox': "[%s %s %s %s]" % tuple(int(round(v, 0)) for v in ttf.bbox),
+                    'ItalicAngle': int(ttf.italicAngle),
+                    'StemV': int(round(ttf.stemV, 0)),
+                    'MissingWidth': int(round(ttf.defaultWidth, 0)),
+                },
+                'up': round(ttf.underlinePosition),
+                'ut': round(ttf.underlineThickness),
+                'originalsize': size,
+                'cw': ttf.charWidths,
+            }
+
+        font_metrics['ttffile'] = ttf_path
+        _font_metrics[ttf_path] = font_metrics
+        logger.info(f"Loaded font metrics for {os.path.basename(ttf_path)}")
+        return font_metrics
+
+
+def find_fallback_fonts(names=FALLBACK_FONT_FILES, search_dirs=FALLBACK_FONT_DIRS):
+    """Locate installed fallback fonts, in the order given by `names`"""
+    found = {}
+    wanted = {name.lower(): name for name in names}
+    for directory in search_dirs:
+        if not os.path.isdir(directory):
+            continue
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                name = wanted.get(filename.lower())
+                if name and name not in found:
+                    found[name] = os.path.join(root, filename)
+    return [found[name] for name in names if name in found]
+
+
+def is_arabic(text):
+    return any(start <= ord(ch) <= end for ch in text for start, end in ARABIC_RANGES)
+
+
+def shape_rtl(text):
+    """Join Arabic letter forms and put the run in visual order, when the optional libraries are installed"""
+    if arabic_reshaper is None or get_display is None:
+        return text
+    return get_display(arabic_reshaper.reshape(text))
+
+
+def inline_segments(text):
+    """Split paragraph markup into (style, text) pairs, honouring <b>, <i> and <br>"""
+    text = BREAK_RE.sub('\n', text)
+    segments = []
+    for match in INLINE_RE.finditer(text):
+        if match.group(1):
+            style = 'B' if match.group(1) == 'b' else 'I'
+            content = TAG_RE.sub('', match.group(2))
+        elif match.group(0).startswith('<'):
+            continue  # Any other tag carries no text
+        else:
+            style, content = '', match.group(0)
+        content = html.unescape(SPACE_RE.sub(' ', content))
+        if content:
+            segments.append((style, content))
+    return segments
+
+
+class ScriptPDF(FPDF):
+    """A4 page template shared by every script: margins, auto page break and numbered footer"""
+
+    def __init__(self, engine):
+        super().__init__(format='A4')
+        self.engine = engine
+        self.set_margins(engine.margin, engine.margin, engine.margin)
+        self.set_auto_page_break(True, engine.margin)
+        self.alias_nb_pages()
+
+    def register_font(self, family, style, font_metrics):
+        """Add preloaded TTF metrics, the equivalent of add_font(uni=True) without touching disk"""
+        fontkey = family + style
+        if fontkey in self.fonts:
+            return
+        self.fonts[fontkey] = {
+            'i': len(self.fonts) + 1, 'type': font_metrics['type'],
+            'name': font_metrics['name'], 'desc': font_metrics['desc'],
+            'up': font_metrics['up'], 'ut': font_metrics['ut'],
+            'cw': font_metrics['cw'],
+            'ttffile': font_metrics['ttffile'], 'fontkey': fontkey,
+            'subset': list(range(0, 57)), 'unifilename': None,
+        }
+        self.font_files[fontkey] = {'length1': font_metrics['originalsize'], 'type': 'TTF', 'ttffile': font_metrics['ttffile']}
+
+    def get_string_width(self, s):
+        # fpdf stores zero advance widths (combining marks such as Devanagari vowel signs) as 65535,
+        # so they don't read as missing glyphs, but counts them at face value when measuring text
+        width = super().get_string_width(s)
+        cw = self.current_font['cw']
+        marks = sum(1 for ch in s if ord(ch) < len(cw) and cw[ord(ch)] == ZERO_WIDTH)
+        return width - marks * ZERO_WIDTH * self.font_size / 1000.0
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font(self.engine.family, 'I', 8)
+        self.set_text_color(100, 100, 100)
+        self.cell(0, 10, f'Page {self.page_no()}/{{nb}}', 0, 0, 'C')
+
+
+class PdfEngine:
+    """
+    Renders parsed script content to PDF with embedded Unicode TTF fonts.
+
+    Roboto covers Latin, Greek and Cyrillic. Characters it has no glyph for
+    are written with the first fallback font that has one (the bundled Noto
+    Devanagari and Arabic fonts, then any installed), and Arabic runs are
+    shaped when arabic_reshaper and python-bidi are available. Fonts are
+    loaded once per process and shared by every render.
+    """
+
+    family = 'roboto'
+
+    def __init__(self, font_dir=FONT_DIR, fallback_fonts=None, margin=20):
+        self.font_dir = font_dir
+        self.margin = margin
+        self.effective_width = 210 - (2 * margin)  # A4 width minus margins
+        self.fonts = {style: load_font_metrics(os.path.join(font_dir, filename))
+                      for style, filename in PRIMARY_FONT_FILES.items()}
+        if fallback_fonts is None:
+            fallback_fonts = find_fallback_fonts()
+        self.fallbacks = []
+        for path in fallback_fonts:
+            try:
+                self.fallbacks.append((f'fallback{len(self.fallbacks)}', load_font_metrics(path)))
+            except Exception as e:
+                logger.warning(f"Skipping fallback font {path}: {str(e)}")
+        self._fallback_metrics = dict(self.fallbacks)
+        self._char_fonts = {}
+
+    def font_for_char(self, ch):
+        """Family used for one character: Roboto if it has the glyph, else the first fallback that does"""
+        family = self._char_fonts.get(ch)
+        if family is None:
+            family = self.family
+            code = ord(ch)
+            if not ch.isspace() and not self.fonts['']['cw'][code]:
+                for name, font_metrics in self.fallbacks:
+                    if font_metrics['cw'][code]:
+                        family = name
+                        break
+                else:
+                    # Logged once per character, since the choice is cached
+                    logger.warning(f"No loaded font has a glyph for U+{code:04X}; it will render as a missing glyph "
+                                   f"(add a font covering it to static/fonts or PDF_FALLBACK_FONTS)")
+            self._char_fonts[ch] = family
+        return family
+
+    def font_runs(self, text):
+        """
+        Split text into (family, text) runs by glyph coverage.
+
+        Spaces and punctuation between two Arabic characters stay in the
+        Arabic run when its font has them, so a whole phrase is shaped and
+        put in visual order at once rather than word by word.
+        """
+        runs = []
+        for ch in text:
+            if ord(ch) > 0xFFFF:
+                continue  # fpdf only addresses the Basic Multilingual Plane
+            family = self.font_for_char(ch)
+            if runs and runs[-1][0] == family:
+                runs[-1][1].append(ch)
+            else:
+                runs.append((family, [ch]))
+
+        merged = []
+        for index, (family, chars) in enumerate(runs):
+            following = runs[index + 1] if index + 1 < len(runs) else None
+            if merged and following and self._joins_rtl(merged[-1], chars, following):
+                merged[-1][1].extend(chars + following[1])
+                runs[index + 1] = (None, [])  # consumed
+                continue
+            if family is None:
+                continue
+            if merged and merged[-1][0] == family:
+                merged[-1][1].extend(chars)
+            else:
+                merged.append((family, list(chars)))
+        return [(family, ''.join(chars)) for family, chars in merged]
+
+    def _joins_rtl(self, previous, chars, following):
+        """Whether neutral `chars` sit between two runs of the same Arabic fallback font and belong in it"""
+        family = previous[0]
+        if family == self.family or following[0] != family:
+            return False
+        if not (is_arabic(previous[1][-1]) and is_arabic(following[1][0])):
+            return False
+        widths = self._fallback_metrics[family]['cw']
+        return all(unicodedata.bidirectional(ch) in RTL_NEUTRAL_CLASSES and widths[ord(ch)] for ch in chars)
+
+    def new_document(self):
+        pdf = ScriptPDF(self)
+        for style, font_metrics in self.fonts.items():
+            pdf.register_font(self.family, style, font_metrics)
+        return pdf
+
+    def write_text(self, pdf, text, style, size, line_height):
+        """Write flowing text, switching fonts per run so every glyph is covered"""
+        for family, run in self.font_runs(text):
+            if family == self.family:
+                pdf.set_font(family, style, size)
+            else:
+                # Fallback fonts only ship a regular cut, and are registered (so embedded) only once used
+                pdf.register_font(family, '', self._fallback_metrics[family])
+                pdf.set_font(family, '', size)
+                if is_arabic(run):
+                    run = shape_rtl(run)
+            pdf.write(line_height, run)
+
+    def render(self, content_structure, filepath):
+        """Create PDF with consistent margins and padding"""
+        pdf = self.new_document()
+        pdf.add_page()
+
+        # Title and timestamp
+        pdf.set_font(self.family, 'B', 24)
+        pdf.cell(self.effective_width, 15, "Generated Video Script", ln=True, align='C')
+        pdf.ln(5)
+
+        pdf.set_font(self.family, 'I', 11)
+        pdf.set_text_color(100, 100, 100)
+        timestamp_text = f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        pdf.cell(self.effective_width, 8, timestamp_text, ln=True, align='R')
+        pdf.ln(10)
+
+        # Reset text color
+        pdf.set_text_color(0, 0, 0)
+
+        for item in content_structure:
+            if item['type'] == 'header':
+                pdf.set_font(self.family, 'B', 14)
+                pdf.cell(6, 10, "-", 0, 0, 'R')  # Bullet point
+                # Indent wrapped header lines past the bullet
+                pdf.set_left_margin(self.margin + 6)
+                self.write_text(pdf, SPACE_RE.sub(' ', item['content']).strip(), 'B', 14, 10)
+                pdf.set_left_margin(self.margin)
+                pdf.ln(10)
+                pdf.ln(2)
+
+            elif item['type'] == 'paragraph':
+                for style, text in inline_segments(item['content']):
+                    self.write_text(pdf, text, style, 12, 7)
+                pdf.ln(7)
+                pdf.ln(4)
+
+        pdf.output(filepath)
+
+
+def get_engine():
+    """The per-process engine, created on first use"""
+    global _default_engine
+    if _default_engine is None:
+        # Extra fonts can be listed explicitly, separated like PATH entries
+        configured = os.getenv('PDF_FALLBACK_FONTS')
+        fallback_fonts = [path for path in configured.split(os.pathsep) if path] if configured else None
+        _default_engine = PdfEngine(fallback_fonts=fallback_fonts)
+    return _default_engine
+
+
+def create_styled_pdf(content_structure, filepath):
+    """Create PDF with consistent margins and padding"""
+    get_engine().render(content_structure, filepath)
+
+
+def content_hash(content_structure):
+    """Stable hash of parsed script content, used to name and deduplicate rendered PDFs"""
+    payload = json.dumps(content_structure, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_to_path(content_structure, filepath):
+    """Render into a temporary file and move it into place, so a PDF is never served half-written"""
+    tmp_path = f'{filepath}.{os.getpid()}.tmp'
+    try:
+        create_styled_pdf(content_structure, tmp_path)
+        os.replace(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return filepath
+
+
+class PdfRenderPool:
+    """
+    Renders script PDFs in worker processes, deduplicated by content hash.
+
+    Each distinct content structure is rendered once to `<output_dir>/<hash>.pdf`;
+    submitting content that is already rendered or still rendering reuses
+    that result. Workers are spawned (not forked) on first use, since the web
+    process runs threads.
+
+    A worker that dies (OOM, segfault) breaks the whole executor and fails
+    every render queued on it with BrokenProcessPool. The broken executor is
+    replaced on the next submit, and renders lost that way are re-queued
+    once on the new one; a render that breaks the pool twice is failed.
+    """
+
+    def __init__(self, output_dir, workers=2, crash_retries=1):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.crash_retries = crash_retries
+        self._executor = None
+        self._futures = {}
+        self._contents = {}   # pdf_hash -> content structure, kept until its render succeeds
+        self._crashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def path_for(self, pdf_hash):
+        return os.path.join(self.output_dir, f'{pdf_hash}.pdf')
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._executor
+
+    def _reset_executor(self):
+        """Drop a broken executor so the next submit spawns fresh workers (lock held)"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning("PDF render pool broke, starting new workers")
+
+    def _queue(self, pdf_hash, content_structure):
+        """Submit one render, replacing the executor if it has broken (lock held)"""
+        filepath = self.path_for(pdf_hash)
+        try:
+            future = self._get_executor().submit(render_to_path, content_structure, filepath)
+        except BrokenProcessPool:
+            self._reset_executor()
+            future = self._get_executor().submit(render_to_path, content_structure, filepath)
+        self._futures[pdf_hash] = future
+        self._contents[pdf_hash] = content_structure
+        queued_at = time.perf_counter()
+        future.add_done_callback(lambda f, h=pdf_hash, t=queued_at: self._on_done(h, f, t))
+        return future
+
+    def submit(self, content_structure):
+        """Queue a render unless identical content is already rendered or rendering; returns its hash"""
+        pdf_hash = content_hash(content_structure)
+        filepath = self.path_for(pdf_hash)
+        with self._lock:
+            if os.path.exists(filepath):
+                logger.info(f"PDF {pdf_hash[:12]} already rendered, reusing it")
+                return pdf_hash
+            future = self._futures.get(pdf_hash)
+            if future and not (future.done() and future.exception()):
+                return pdf_hash
+
+            self._crashes.pop(pdf_hash, None)
+            self._queue(pdf_hash, content_structure)
+        logger.info(f"Queued PDF render {pdf_hash[:12]}")
+        return pdf_hash
+
+    def _on_done(self, pdf_hash, future, queued_at):
+        error = future.exception()
+        # Queue wait included, since that is what a download ends up waiting on
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - queued_at, 'pdf_render')
+        if error is None:
+            with self._lock:
+                if self._futures.get(pdf_hash) is future:
+                    self._futures.pop(pdf_hash, None)
+                    self._contents.pop(pdf_hash, None)
+                    self._crashes.pop(pdf_hash, None)
+        else:
+            logger.error(f"PDF render {pdf_hash[:12]} failed: {str(error) or type(error).__name__}")
+
+    def _requeue_crashed(self, pdf_hash, future):
+        """Re-queue a render lost to a broken pool, returning its new future (or None)"""
+        if not isinstance(future.exception(), BrokenProcessPool):
+            return None
+        with self._lock:
+            current = self._futures.get(pdf_hash)
+            if current is not future:
+                return current   # already re-queued by another waiter or submit
+            crashes = self._crashes.get(pdf_hash, 0)
+            content_structure = self._contents.get(pdf_hash)
+            if content_structure is None or crashes >= self.crash_retries:
+                return None
+            self._crashes[pdf_hash] = crashes + 1
+            logger.warning(f"Re-queuing PDF render {pdf_hash[:12]} after a worker crash")
+            return self._queue(pdf_hash, content_structure)
+
+    def status(self, pdf_hash):
+        if os.path.exists(self.path_for(pdf_hash)):
+            return READY
+        with self._lock:
+            future = self._futures.get(pdf_hash)
+        if future is None:
+            return MISSING
+        if future.done():
+            if future.exception() and self._requeue_crashed(pdf_hash, future):
+                return PENDING
+            return FAILED if future.exception() else READY
+        return PENDING
+
+    def wait(self, pdf_hash, timeout=None):
+        """Block until a pending render finishes or `timeout` passes, then return its status"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            future = self._futures.get(pdf_hash)
+        while future is not None:
+            try:
+                future.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+                break
+            except FuturesTimeoutError:
+                return PENDING
+            except Exception:
+                # A render lost to a crashed worker is retried on fresh workers
+                future = self._requeue_crashed(pdf_hash, future)
+                if future is None:
+                    return FAILED
+        return self.status(pdf_hash)
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(1 for future in self._futures.values() if not future.done())
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(model, temperature, system_prompt, prompt, additional_context=""):
+    """Content-addressed key for a completion request"""
+    payload = json.dumps([model, temperature, system_prompt, prompt.strip(), (additional_context or "").strip()],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for generated scripts.
+
+    The memory tier is an LRU bounded by entry count and total characters.
+    The disk tier stores one JSON file per key and evicts entries older than
+    `ttl` seconds, both on read and in a periodic sweep.
+    """
+
+    def __init__(self, cache_dir, max_entries=256, max_chars=4 * 1024 * 1024, ttl=7 * 24 * 3600,
+                 sweep_every=100):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self.sweep_every = sweep_every
+        self._memory = OrderedDict()
+        self._memory_chars = 0
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and time.time() - entry['created_at'] < self.ttl:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry['value']
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['disk_hits'] += 1
+            self._remember(key, entry)
+        return entry['value']
+
+    def set(self, key, value):
+        entry = {'created_at': time.time(), 'value': value}
+        with self._lock:
+            self._remember(key, entry)
+            self._puts += 1
+            sweep = self._puts % self.sweep_every == 0
+        self._write_disk(key, entry)
+        if sweep:
+            self.sweep()
+
+    def _remember(self, key, entry):
+        """Insert into the memory tier and evict least recently used entries (lock held)"""
+        if key in self._memory:
+            self._memory_chars -= len(self._memory.pop(key)['value'])
+        self._memory[key] = entry
+        self._memory_chars += len(entry['value'])
+        while self._memory and (len(self._memory) > self.max_entries or self._memory_chars > self.max_chars):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_chars -= len(evicted['value'])
+            self.stats['evictions'] += 1
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {str(e)}")
+            self._remove(path)
+            return None
+
+        if time.time() - entry.get('created_at', 0) >= self.ttl:
+            self._remove(path)
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Error writing cache entry {path}: {str(e)}")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def sweep(self):
+        """Delete expired entries from the disk tier"""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        if removed:
+            logger.info(f"Response cache sweep removed {removed} expired entries")
+        return removed
+
+    def get_stats(self):
+        with self._lock:
+            hits = self.stats['memory_hits'] + self.stats['disk_hits']
+            lookups = hits + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_chars': self._memory_chars,
+            }
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limited(error):
+    """True for a provider 429, which is worth waiting out rather than failing"""
+    return getattr(error, 'status_code', None) == 429
+
+
+def retry_after(error, default):
+    """Seconds the provider asked us to wait, from the Retry-After header when present"""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `per_minute / 60` per second.
+
+    Not thread-safe on its own; RateLimitScheduler holds its lock around
+    every call.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.per_minute = per_minute
+        self.capacity = capacity or per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, factor, now):
+        """Scale the refill rate, crediting tokens earned at the old rate first"""
+        self.refill(now)
+        self.rate = self.per_minute * factor / 60.0
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` tokens are available (amounts above capacity wait for a full bucket)"""
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimitScheduler:
+    """
+    Paces model calls to stay inside requests-per-minute and tokens-per-minute quotas.
+
+    Callers `acquire` an estimated token cost before each call and block
+    until both buckets can cover it. A 429 pauses everyone until the
+    provider's Retry-After and halves the refill rate; each success then
+    recovers a little of it (additive increase, multiplicative decrease),
+    so throughput settles just under the real quota.
+    """
+
+    def __init__(self, requests_per_minute=30, tokens_per_minute=6000, min_factor=0.1, recovery=0.05):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.min_factor = min_factor
+        self.recovery = recovery
+        self.factor = 1.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'acquired': 0, 'rate_limited': 0, 'waited_s': 0.0}
+
+    def acquire(self, tokens):
+        """Block until a call costing about `tokens` tokens may start"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = max(self._paused_until - now,
+                            self.requests.wait_time(1, now),
+                            self.tokens.wait_time(tokens, now))
+                if delay <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    self.stats['acquired'] += 1
+                    self.stats['waited_s'] += waited
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    def record_success(self):
+        with self._lock:
+            if self.factor < 1.0:
+                self._set_factor(min(1.0, self.factor + self.recovery))
+
+    def record_rate_limit(self, delay):
+        """Back off after a 429: pause all callers for `delay` seconds and halve the rate"""
+        with self._lock:
+            self.stats['rate_limited'] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._set_factor(max(self.min_factor, self.factor / 2))
+        logger.warning(f"Rate limited; pausing {delay:.1f}s and slowing to {self.factor:.0%} of quota")
+
+    def _set_factor(self, factor):
+        now = time.monotonic()
+        self.factor = factor
+        self.requests.set_rate(factor, now)
+        self.tokens.set_rate(factor, now)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                **self.stats,
+                'waited_s': round(self.stats['waited_s'], 2),
+                'rate_factor': round(self.factor, 3),
+                'requests_per_minute': self.requests.per_minute,
+                'tokens_per_minute': self.tokens.per_minute,
+            }
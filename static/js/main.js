@@ -87,6 +87,105 @@ function formatScript(script) {
     return formattedScript;
 }
 
+function renderScript(script, final = true) {
+    const formattedScript = formatScript(script);
+    scriptContent.innerHTML = `
+        <div class="space-y-6">
+            ${formattedScript}
+        </div>
+    `;
+
+    const paragraphs = scriptContent.querySelectorAll('p');
+    paragraphs.forEach(p => {
+        p.classList.add('text-gray-700', 'leading-relaxed', 'text-lg');
+    });
+
+    if (final) {
+        // Clean up any remaining markdown artifacts
+        scriptContent.innerHTML = scriptContent.innerHTML
+            .replace(/\\\*/g, '*') // Restore escaped asterisks
+            .replace(/\s*\*\s*/g, '') // Remove any remaining standalone asterisks
+            .replace(/\s{2,}/g, ' '); // Clean up extra spaces
+    }
+}
+
+// Parse a single Server-Sent Events frame into { event, data }
+function parseSseFrame(frame) {
+    let event = 'message';
+    const dataLines = [];
+    frame.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    if (!dataLines.length) return null;
+    return { event, data: JSON.parse(dataLines.join('\n')) };
+}
+
+// Stream the script from the server, rendering chunks as they arrive
+async function streamScript(formData) {
+    const response = await fetch('/generate_script/stream', {
+        method: 'POST',
+        body: formData,
+        headers: { 'Accept': 'text/event-stream' }
+    });
+
+    if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.error || `Request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let script = '';
+    let renderPending = false;
+
+    const scheduleRender = () => {
+        if (renderPending) return;
+        renderPending = true;
+        requestAnimationFrame(() => {
+            renderPending = false;
+            renderScript(script, false);
+        });
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = parseSseFrame(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (!frame) continue;
+
+            if (frame.event === 'first_token') {
+                // First visible output, swap the spinner for the live script
+                loading.classList.add('hidden');
+                results.classList.remove('hidden');
+                console.debug(`Time to first token: ${frame.data.ttft_ms}ms`);
+            } else if (frame.event === 'token') {
+                script += frame.data.delta;
+                scheduleRender();
+            } else if (frame.event === 'restart') {
+                // The generation being followed was dropped and is starting over
+                script = '';
+                scheduleRender();
+            } else if (frame.event === 'done') {
+                return frame.data;
+            } else if (frame.event === 'error') {
+                throw new Error(frame.data.error);
+            }
+        }
+    }
+
+    throw new Error('Stream ended unexpectedly');
+}
+
 scriptForm.addEventListener('submit', async (e) => {
     e.preventDefault();
     loading.classList.remove('hidden');
@@ -95,31 +194,20 @@ scriptForm.addEventListener('submit', async (e) => {
     const formData = new FormData(scriptForm);
 
     try {
-        const response = await axios.post('/generate_script', formData);
+        let result;
+        if (window.ReadableStream && window.TextDecoder) {
+            result = await streamScript(formData);
+        } else {
+            const response = await axios.post('/generate_script', formData);
+            result = response.data;
+        }
         
-        if (response.data.success) {
-            const formattedScript = formatScript(response.data.script);
-            scriptContent.innerHTML = `
-                <div class="space-y-6">
-                    ${formattedScript}
-                </div>
-            `;
-            
-            const paragraphs = scriptContent.querySelectorAll('p');
-            paragraphs.forEach(p => {
-                p.classList.add('text-gray-700', 'leading-relaxed', 'text-lg');
-            });
-
-            // Clean up any remaining markdown artifacts
-            scriptContent.innerHTML = scriptContent.innerHTML
-                .replace(/\\\*/g, '*') // Restore escaped asterisks
-                .replace(/\s*\*\s*/g, '') // Remove any remaining standalone asterisks
-                .replace(/\s{2,}/g, ' '); // Clean up extra spaces
-
+        if (result.success) {
+            renderScript(result.script);
             results.classList.remove('hidden');
             showToast('success', 'Script generated successfully!');
         } else {
-            showToast('error', 'Error generating script: ' + response.data.error);
+            showToast('error', 'Error generating script: ' + result.error);
         }
     } catch (error) {
         showToast('error', 'Error: ' + (error.response?.data?.error || error.message));
@@ -0,0 +1,373 @@
+import base64
+import binascii
+import hashlib
+import html
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 4
+
+# Seconds a process opening the store waits for another one's schema migration to finish
+MIGRATION_TIMEOUT = 600
+
+SUMMARY_COLUMNS = 'filename, title, timestamp, preview'
+
+# Summary rows point at their body by content hash; bodies are zlib-compressed JSON
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS scripts (
+        id INTEGER PRIMARY KEY,
+        filename TEXT NOT NULL UNIQUE,
+        title TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        preview TEXT NOT NULL DEFAULT '',
+        content_hash TEXT,
+        pdf_hash TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_scripts_timestamp ON scripts (timestamp, filename);
+    CREATE INDEX IF NOT EXISTS idx_scripts_content_hash ON scripts (content_hash);
+    CREATE INDEX IF NOT EXISTS idx_scripts_pdf_hash ON scripts (pdf_hash);
+    CREATE TABLE IF NOT EXISTS script_bodies (
+        content_hash TEXT PRIMARY KEY,
+        body BLOB NOT NULL
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS scripts_fts USING fts5 (
+        title,
+        body,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '3'
+    );
+'''
+
+TAG_RE = re.compile(r'<[^>]+>')
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Snippet markers that can't occur in text, swapped for <mark> after escaping
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def searchable_body(entry):
+    """Plain text indexed for a script: its rendered HTML, or the raw sections as a fallback"""
+    formatted_html = entry.get('formatted_html', '')
+    if formatted_html:
+        return html.unescape(TAG_RE.sub(' ', formatted_html))
+    parts = []
+    for section in entry.get('sections', []):
+        parts.append(section.get('title', ''))
+        parts.extend(section.get('content', []))
+    return ' '.join(parts)
+
+
+def encode_body(entry):
+    """(compressed blob, content hash) for a script's sections and formatted HTML"""
+    raw = json.dumps({
+        'sections': entry.get('sections', []),
+        'formatted_html': entry.get('formatted_html', ''),
+    }, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return zlib.compress(raw, 6), hashlib.sha256(raw).hexdigest()
+
+
+def decode_body(blob):
+    """{'sections': [...], 'formatted_html': ...} from an encode_body blob"""
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def build_match_query(query):
+    """
+    Turn free text into an FTS5 query where every word must match.
+
+    The last word also matches as a prefix (search-as-you-type) once it has
+    at least three characters, which the prefix index covers; shorter
+    prefixes would expand to a large share of the vocabulary.
+    """
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) >= 3:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def encode_cursor(entry):
+    """Opaque pagination cursor pointing just past `entry`"""
+    raw = json.dumps([entry['timestamp'], entry['filename']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        timestamp, filename = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, TypeError, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return timestamp, filename
+
+
+class ScriptStore:
+    """
+    Saved script metadata backed by SQLite.
+
+    The database runs in WAL mode so readers never block the writer, and
+    each thread gets its own connection. The `scripts` table is a compact
+    index of summary records (filename, title, timestamp, preview and the
+    hashes of the script's content and rendered PDF), keyed by filename and
+    ordered by timestamp. Script bodies, the sections and formatted HTML,
+    live in `script_bodies` as compressed blobs, stored once per distinct
+    content and read only when a script's content is asked for, so
+    listing, lookups and deletes never touch them.
+
+    Titles and bodies are also kept in an FTS5 index, keyed by the script's
+    row id and updated in the same transaction as the row, for BM25-ranked
+    search. Entries from the legacy JSON metadata file are imported once,
+    the first time the database is opened, and databases from before the
+    split are migrated on open. Schema setup runs under the database's
+    write lock, so when several processes open it at once one migrates
+    and the rest wait, then find nothing left to do.
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        # A connection of its own, with a busy timeout long enough to outlast another process's
+        # migration; the version and layout are only read once this one holds the write lock
+        conn = sqlite3.connect(self.db_path, timeout=MIGRATION_TIMEOUT, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                columns = [row['name'] for row in conn.execute('PRAGMA table_info(scripts)')]
+                if 'sections' in columns:
+                    self._split_bodies(conn)
+                self._create_tables(conn)
+                if version < 1:
+                    self._migrate_legacy_json(conn)
+                if version < SCHEMA_VERSION:
+                    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_tables(conn):
+        """Create any missing tables and indexes, statement by statement so the caller's transaction holds"""
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+
+    def _migrate_legacy_json(self, conn):
+        """Import entries from scripts_metadata.json (caller holds the transaction)"""
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
+        try:
+            with open(self.legacy_json_path, 'r') as f:
+                entries = json.load(f)
+        except Exception as e:
+            logger.error(f"Could not read legacy metadata for migration: {str(e)}")
+            return
+
+        for entry in entries:
+            if entry.get('filename'):
+                self._write(conn, entry)
+        logger.info(f"Migrated {len(entries)} script entries from {self.legacy_json_path}")
+
+    def _split_bodies(self, conn):
+        """
+        Move bodies stored inline (schema 3 and earlier) into compressed blobs.
+
+        Runs inside the caller's transaction: the old table is renamed
+        aside, every row is rewritten into the new layout and re-indexed for
+        search under its new row id, then the old table and search index
+        are dropped.
+        """
+        logger.info("Moving script bodies out of the metadata index (one-time migration)")
+        conn.execute('ALTER TABLE scripts RENAME TO scripts_inline')
+        conn.execute('DROP INDEX IF EXISTS idx_scripts_timestamp')
+        conn.execute('DROP INDEX IF EXISTS idx_scripts_pdf_hash')
+        conn.execute('DROP TABLE IF EXISTS scripts_fts')
+        self._create_tables(conn)
+        migrated = 0
+        for row in conn.execute('SELECT * FROM scripts_inline'):
+            entry = dict(row)
+            entry['sections'] = json.loads(entry['sections'] or '[]')
+            self._write(conn, entry)
+            migrated += 1
+        conn.execute('DROP TABLE scripts_inline')
+        logger.info(f"Moved {migrated} script bodies out of the metadata index")
+
+    def _write(self, conn, entry):
+        """Insert or update one entry's summary row, body blob and search row (caller holds the transaction)"""
+        body, content_hash = encode_body(entry)
+        conn.execute('INSERT OR IGNORE INTO script_bodies (content_hash, body) VALUES (?, ?)', (content_hash, body))
+        summary = (entry.get('title', ''), entry.get('timestamp', ''), entry.get('preview', ''),
+                   content_hash, entry.get('pdf_hash'))
+
+        existing = conn.execute('SELECT id, content_hash FROM scripts WHERE filename = ?',
+                                (entry['filename'],)).fetchone()
+        if existing:
+            script_id = existing['id']
+            conn.execute('UPDATE scripts SET title = ?, timestamp = ?, preview = ?, content_hash = ?, pdf_hash = ? '
+                         'WHERE id = ?', (*summary, script_id))
+            conn.execute('DELETE FROM scripts_fts WHERE rowid = ?', (script_id,))
+            if existing['content_hash'] != content_hash:
+                self._release_body(conn, existing['content_hash'])
+        else:
+            script_id = conn.execute(
+                'INSERT INTO scripts (filename, title, timestamp, preview, content_hash, pdf_hash) '
+                'VALUES (?, ?, ?, ?, ?, ?)', (entry['filename'], *summary)).lastrowid
+        conn.execute('INSERT INTO scripts_fts (rowid, title, body) VALUES (?, ?, ?)',
+                     (script_id, entry.get('title', ''), searchable_body(entry)))
+
+    @staticmethod
+    def _release_body(conn, content_hash):
+        """Drop a body blob once no script refers to it"""
+        conn.execute('DELETE FROM script_bodies WHERE content_hash = ? '
+                     'AND NOT EXISTS (SELECT 1 FROM scripts WHERE content_hash = ?)', (content_hash, content_hash))
+
+    def add(self, entry):
+        """Insert or replace one script entry; `sections` and `formatted_html` go to its body blob"""
+        conn = self._connect()
+        with conn:
+            self._write(conn, entry)
+
+    def add_many(self, entries):
+        """Insert or replace many entries in a single transaction"""
+        conn = self._connect()
+        with conn:
+            for entry in entries:
+                self._write(conn, entry)
+
+    def get(self, filename):
+        """One summary record plus its content and PDF hashes, without the body"""
+        row = self._connect().execute(
+            f'SELECT {SUMMARY_COLUMNS}, content_hash, pdf_hash FROM scripts WHERE filename = ?',
+            (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def get_content(self, filename):
+        """The record from get() plus its `sections` and `formatted_html`, read from the body blob"""
+        row = self._connect().execute(
+            f'SELECT {SUMMARY_COLUMNS}, s.content_hash, pdf_hash, b.body FROM scripts s '
+            'LEFT JOIN script_bodies b ON b.content_hash = s.content_hash WHERE filename = ?',
+            (filename,)).fetchone()
+        if not row:
+            return None
+        entry = dict(row)
+        blob = entry.pop('body')
+        if blob is None:
+            logger.warning(f"Script {filename} has no stored body")
+            entry.update(sections=[], formatted_html='')
+        else:
+            entry.update(decode_body(blob))
+        return entry
+
+    def set_pdf_hash(self, filename, pdf_hash):
+        """Point a script at a different rendered PDF"""
+        conn = self._connect()
+        with conn:
+            conn.execute('UPDATE scripts SET pdf_hash = ? WHERE filename = ?', (pdf_hash, filename))
+
+    def delete(self, filename):
+        """Delete one script entry, and its body if no other script shares it; returns True if it existed"""
+        conn = self._connect()
+        with conn:
+            row = conn.execute('SELECT id, content_hash FROM scripts WHERE filename = ?', (filename,)).fetchone()
+            if not row:
+                return False
+            conn.execute('DELETE FROM scripts WHERE id = ?', (row['id'],))
+            conn.execute('DELETE FROM scripts_fts WHERE rowid = ?', (row['id'],))
+            self._release_body(conn, row['content_hash'])
+        return True
+
+    def count_pdf_references(self, pdf_hash):
+        """Number of scripts sharing one rendered PDF"""
+        return self._connect().execute('SELECT COUNT(*) FROM scripts WHERE pdf_hash = ?', (pdf_hash,)).fetchone()[0]
+
+    def list_scripts(self):
+        """All summary records, newest first"""
+        rows = self._connect().execute(f'SELECT {SUMMARY_COLUMNS} FROM scripts ORDER BY timestamp DESC, filename DESC')
+        return [dict(row) for row in rows]
+
+    def list_page(self, limit=24, cursor=None):
+        """
+        One page of summary records (no script bodies), newest first.
+
+        Returns (entries, next_cursor); next_cursor is None on the last page.
+        Paging uses a keyset on (timestamp, filename), so each page is an
+        index range scan regardless of how deep the client has scrolled.
+        """
+        params = []
+        where = ''
+        if cursor:
+            where = 'WHERE (timestamp, filename) < (?, ?)'
+            params.extend(decode_cursor(cursor))
+        rows = self._connect().execute(
+            f'SELECT {SUMMARY_COLUMNS} FROM scripts {where} '
+            'ORDER BY timestamp DESC, filename DESC LIMIT ?',
+            (*params, limit + 1)).fetchall()
+
+        entries = [dict(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(entries[-1]) if len(rows) > limit else None
+        return entries, next_cursor
+
+    def search(self, query, page=1, per_page=20):
+        """
+        BM25-ranked full-text search over titles and bodies.
+
+        Title matches weigh more than body matches. Returns (results, total);
+        each result is a summary record plus `score` and an HTML-escaped
+        `snippet` with matches wrapped in <mark>.
+        """
+        match = build_match_query(query)
+        if not match:
+            return [], 0
+
+        conn = self._connect()
+        total = conn.execute('SELECT COUNT(*) FROM scripts_fts WHERE scripts_fts MATCH ?', (match,)).fetchone()[0]
+        rows = conn.execute(
+            'SELECT s.filename, s.title, s.timestamp, s.preview, '
+            '       bm25(scripts_fts, 5.0, 1.0) AS score, '
+            '       snippet(scripts_fts, 1, ?, ?, \'…\', 16) AS snippet '
+            'FROM scripts_fts JOIN scripts s ON s.id = scripts_fts.rowid '
+            'WHERE scripts_fts MATCH ? '
+            'ORDER BY score LIMIT ? OFFSET ?',
+            (MARK_START, MARK_END, match, per_page, (page - 1) * per_page)).fetchall()
+
+        results = []
+        for row in rows:
+            result = dict(row)
+            # bm25() is lower-is-better; flip it so callers see higher-is-better
+            result['score'] = round(-result['score'], 6)
+            result['snippet'] = (html.escape(result['snippet'] or '')
+                                 .replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+            results.append(result)
+        return results, total
+
+    def count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM scripts').fetchone()[0]
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_render
+
+
+class RecordingPDF:
+    """Stands in for ScriptPDF, keeping what write_text() hands to fpdf"""
+
+    def __init__(self):
+        self.written = []
+
+    def register_font(self, family, style, metrics):
+        pass
+
+    def set_font(self, family, style, size):
+        pass
+
+    def write(self, line_height, text):
+        self.written.append(text)
+
+
+@pytest.fixture(scope='module')
+def engine():
+    engine = pdf_render.PdfEngine()
+    if not any(metrics['cw'][ord('م')] for _, metrics in engine.fallbacks):
+        pytest.skip("No Arabic fallback font available")
+    return engine
+
+
+@pytest.mark.skipif(pdf_render.arabic_reshaper is None, reason="arabic-reshaper and python-bidi are not installed")
+def test_arabic_line_is_written_in_visual_word_order(engine):
+    words = ['مرحبا', 'بالعالم', 'الكبير']
+    pdf = RecordingPDF()
+
+    engine.write_text(pdf, ' '.join(words), '', 12, 7)
+
+    # One run for the whole phrase, its words laid out right to left
+    assert len(pdf.written) == 1
+    assert pdf.written[0].split(' ') == [pdf_render.shape_rtl(word) for word in reversed(words)]
+
+
+def test_arabic_phrase_stays_in_one_run_between_latin_text(engine):
+    runs = engine.font_runs('Hello مرحبا بالعالم world')
+
+    assert [text for _, text in runs] == ['Hello ', 'مرحبا بالعالم', ' world']